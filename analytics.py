@@ -0,0 +1,159 @@
+import calendar
+import threading
+from datetime import date, datetime
+
+import numpy as np
+
+import database
+
+# Windows reported by rolling counts, in days (ending today)
+ROLLING_WINDOWS = (7, 30, 90)
+
+DAY = 86400
+# date.toordinal() of 1970-01-01
+EPOCH_ORDINAL = 719163
+
+class History:
+    """All log times as one int64 array of local wall-clock seconds.
+
+    Loaded once, then extended with logs added since, so repeated
+    analytics calls only pay for the rows they have not seen. Rolled-up
+    logs are kept as (day number, count) arrays, with a mask of the
+    weekly rollups (keyed on their Monday).
+    """
+    def __init__(self):
+        self.version = None
+        self.last_id = 0
+        self.times = np.empty(0, dtype=np.int64)
+        self.rollup_days = np.empty(0, dtype=np.int64)
+        self.rollup_counts = np.empty(0, dtype=np.int64)
+        self.rollup_weekly = np.empty(0, dtype=bool)
+
+    def refresh(self):
+        version, _ = database.get_data_version()
+        if version == self.version:
+            return self
+        self.version = version
+        rollups = database.get_rollups()
+        self.rollup_days = np.array([day.toordinal() - EPOCH_ORDINAL for day, _, _ in rollups], dtype=np.int64)
+        self.rollup_counts = np.array([count for _, count, _ in rollups], dtype=np.int64)
+        self.rollup_weekly = np.array([days > 1 for _, _, days in rollups], dtype=bool)
+        last_id, new = database.get_local_times(self.last_id)
+        if new:
+            self.times = np.concatenate((self.times, np.frombuffer(new, dtype=np.int64)))
+        self.last_id = last_id
+        # Rows removed since the last load (e.g. a rebuild) need a full reload
+        if len(self.times) != database.count_logs():
+            self.last_id, times = database.get_local_times()
+            self.times = np.frombuffer(times, dtype=np.int64)
+        return self
+
+_history = History()
+_history_lock = threading.Lock()
+
+def load_history():
+    """Returns the cached History, brought up to date."""
+    with _history_lock:
+        return _history.refresh()
+
+def _longest_run(active):
+    # Longest run of True in a boolean array
+    if not active.any():
+        return 0
+    edges = np.diff(np.concatenate(([0], active.view(np.int8), [0])))
+    return int((np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)).max())
+
+def _current_run(active):
+    # Run of True ending at the last slot, or at the one before if the
+    # last is still empty (the period is not over yet)
+    end = len(active)
+    if end and not active[-1]:
+        end -= 1
+    if end <= 0 or not active[end - 1]:
+        return 0
+    inactive = np.flatnonzero(~active[:end])
+    return int(end - (inactive[-1] + 1 if len(inactive) else 0))
+
+def _streaks(index, today):
+    """Current and longest streak over integer periods (days or weeks)."""
+    if not len(index):
+        return {"current": 0, "longest": 0}
+    first = min(int(index.min()), today)
+    counts = np.bincount(index[index <= today] - first, minlength=today - first + 1)
+    active = counts > 0
+    return {"current": _current_run(active), "longest": _longest_run(active)}
+
+def compute(now=None):
+    """Full-history analytics, computed in vectorised passes.
+
+    Daily rollups count on their day. Weekly rollups only count where
+    the day does not matter: total, rolled_up, week streaks and the
+    per-year figures (on their Monday). They are left out of first/last,
+    day streaks, rolling counts and the weekday histogram. The hour
+    histogram only covers logs still kept raw.
+    """
+    now = now or datetime.now()
+    history = load_history()
+    times = history.times
+    local_now = calendar.timegm(now.timetuple())
+    today = local_now // DAY
+
+    # One entry per raw log (weight 1) and per rollup (weight = its count)
+    days = np.concatenate((times // DAY, history.rollup_days))
+    weights = np.concatenate((np.ones(len(times), dtype=np.int64), history.rollup_counts))
+    # 1970-01-01 was a Thursday: shift so weeks start on Monday, as ISO weeks do
+    weeks = (days + 3) // 7
+    this_week = (today + 3) // 7
+    # The same without weekly rollups, for the metrics that need real days
+    daily = ~np.concatenate((np.zeros(len(times), dtype=bool), history.rollup_weekly))
+    known_days, day_weights = days[daily], weights[daily]
+
+    rolling = {}
+    for window in ROLLING_WINDOWS:
+        count = int(day_weights[(known_days > today - window) & (known_days <= today)].sum())
+        rolling[str(window)] = {"count": count, "per_day": round(count / window, 3)}
+
+    weekdays = np.bincount((known_days + 3) % 7, day_weights, minlength=7).astype(np.int64)
+    hours = np.bincount((times % DAY) // 3600, minlength=24)
+
+    # Calendar years, and how much of each year had passed by today's date
+    years = days.astype('datetime64[D]').astype('datetime64[Y]')
+    year_start = years.astype('datetime64[D]').astype(np.int64)
+    day_of_year = days - year_start
+    this_year = now.year
+    elapsed = now.timetuple().tm_yday - 1
+    year_list = []
+    if len(days):
+        year_numbers = years.astype(np.int64) + 1970
+        per_year = np.bincount(year_numbers - year_numbers.min(), weights).astype(np.int64)
+        past = day_of_year <= elapsed
+        to_date = np.bincount(year_numbers[past] - year_numbers.min(), weights[past],
+                              minlength=len(per_year)).astype(np.int64)
+        for offset, count in enumerate(per_year):
+            if count:
+                year_list.append({"year": int(year_numbers.min()) + offset, "count": int(count),
+                                  "to_date": int(to_date[offset])})
+    by_year = {entry["year"]: entry for entry in year_list}
+    current = by_year.get(this_year, {}).get("to_date", 0)
+    previous = by_year.get(this_year - 1, {}).get("to_date", 0)
+
+    return {
+        "total": int(weights.sum()),
+        "rolled_up": int(history.rollup_counts.sum()),
+        "first": date.fromordinal(int(known_days.min()) + EPOCH_ORDINAL).isoformat() if len(known_days) else None,
+        "last": date.fromordinal(int(known_days.max()) + EPOCH_ORDINAL).isoformat() if len(known_days) else None,
+        "streaks": {
+            "day": _streaks(known_days, today),
+            "week": _streaks(weeks, this_week),
+        },
+        "rolling": rolling,
+        "weekdays": weekdays.tolist(),
+        "hours": hours.tolist(),
+        "years": year_list,
+        "year_over_year": {
+            "year": this_year,
+            "to_date": current,
+            "previous_to_date": previous,
+            "change": round(current / previous - 1, 3) if previous else None,
+        },
+    }
@@ -1,12 +1,54 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import date, datetime, time, timedelta
+from email.utils import formatdate, parsedate_to_datetime
+from time import perf_counter
+from pydantic import BaseModel
+from typing import List, Optional
+import asyncio
+import json
+import logging
 import os
 import database
-from tracker import get_weekly_volume, get_weekly_streak
+import async_database
+import metrics
 
-app = FastAPI(title="Habit Tracker API")
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    # Let in-flight database calls finish before the process exits
+    async_database.shutdown()
+
+app = FastAPI(title="Habit Tracker API", lifespan=lifespan)
+
+# Largest page a single /logs?limit= request may ask for
+MAX_PAGE_SIZE = 5000
+
+# Most timestamps a single POST /logs/batch may carry
+MAX_BATCH_SIZE = 100000
+
+# Longest range a single /heatmap request may cover
+MAX_HEATMAP_DAYS = 366
+
+# Rendered responses kept in memory, keyed by URL
+RESPONSE_CACHE_SIZE = 64
+_response_cache = OrderedDict()
+
+# /events: seconds between data version checks while clients are
+# connected, seconds between keep-alive comments, and the largest delta
+# pushed before clients are told to reload instead
+EVENT_POLL_INTERVAL = 0.5
+EVENT_KEEPALIVE = 15
+MAX_EVENT_LOGS = 500
+
+# Make sure the schema and stats aggregates exist
+database.init_db()
 
 # Mount Static Files
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -18,32 +60,343 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Last-Modified"],
 )
 
+class RequestTimer:
+    """ASGI middleware timing each request up to its response headers.
+
+    Timing stops at the start of the response, so streamed bodies and
+    /events do not skew the histogram. Requests are labelled by route.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        start = perf_counter()
+
+        async def timed_send(message):
+            if message['type'] == 'http.response.start':
+                route = getattr(scope.get('route'), 'path', 'other')
+                metrics.observe('http_request', perf_counter() - start, handler=route)
+                metrics.inc('http_requests', handler=route, status=message['status'])
+            await send(message)
+
+        await self.app(scope, receive, timed_send)
+
+app.add_middleware(RequestTimer)
+
 @app.get("/")
 def read_root():
     return FileResponse('templates/index.html')
 
-@app.get("/stats")
-def read_stats():
-    history = database.get_all_logs()
-    offset = database.get_offset()
-    
-    vol = get_weekly_volume(history)
-    streak = get_weekly_streak(history)
-    total = len(history) + offset
-    
-    return {
-        "volume": vol,
-        "streak": streak,
-        "total": total
+async def validators(request, cache_control="no-cache"):
+    """Returns (etag, headers, not_modified) for the current data version.
+
+    Responses also depend on today's date (this week, this year), so the
+    date is part of the ETag and Last-Modified is at least midnight.
+    """
+    version, modified = await async_database.get_data_version()
+    today = date.today()
+    last_modified = max(modified, datetime.combine(today, time()).timestamp())
+
+    etag = f'"{version}-{today.isoformat()}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(last_modified, usegmt=True),
+        "Cache-Control": cache_control,
     }
 
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_none_match is not None:
+        not_modified = if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]
+    elif if_modified_since is not None:
+        try:
+            not_modified = parsedate_to_datetime(if_modified_since).timestamp() >= int(last_modified)
+        except (TypeError, ValueError):
+            not_modified = False
+    else:
+        not_modified = False
+    return etag, headers, not_modified
+
+async def cached_response(request, build, cache_control="no-cache", media_type="application/json"):
+    """Serves await build() -> (body, extra_headers) through ETag checks and the response cache.
+
+    build() only runs when the data changed since the cached copy was made.
+    """
+    etag, headers, not_modified = await validators(request, cache_control)
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+
+    key = str(request.url)
+    entry = _response_cache.get(key)
+    if entry is not None and entry[0] == etag:
+        _response_cache.move_to_end(key)
+        body, extra_headers = entry[1], entry[2]
+    else:
+        body, extra_headers = await build()
+        _response_cache[key] = (etag, body, extra_headers)
+        _response_cache.move_to_end(key)
+        while len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+
+    return Response(body, media_type=media_type, headers={**headers, **extra_headers})
+
+@app.get("/stats")
+async def read_stats(request: Request):
+    async def build():
+        return json.dumps(await async_database.get_stats()), {}
+
+    return await cached_response(request, build)
+
+def in_int64(value):
+    # SQLite integers are 64-bit; larger values cannot be bound to a query
+    return -2**63 <= value < 2**63
+
+def parse_time_bound(value, name):
+    """Parses a since/until query value (epoch seconds or an ISO date/datetime) to epoch seconds."""
+    if value is None:
+        return None
+    try:
+        if value.lstrip('-').isdigit():
+            seconds = int(value)
+        else:
+            seconds = int(datetime.fromisoformat(value).timestamp())
+    except (ValueError, OverflowError, OSError):
+        seconds = None
+    if seconds is None or not in_int64(seconds):
+        raise HTTPException(status_code=400, detail=f"Invalid '{name}': expected epoch seconds or ISO 8601")
+    return seconds
+
+def parse_cursor(value):
+    if value is None:
+        return None
+    try:
+        ts, log_id = value.split('.')
+        cursor = int(ts), int(log_id)
+    except ValueError:
+        cursor = None
+    if cursor is None or not all(in_int64(part) for part in cursor):
+        raise HTTPException(status_code=400, detail="Invalid 'cursor'")
+    return cursor
+
+def ndjson_line(row):
+    return json.dumps({"id": row['id'], "timestamp": row['timestamp'], "ts": row['ts']}) + '\n'
+
+async def stream_json_array(rows):
+    separator = ''
+    yield '['
+    async for row in rows:
+        yield separator + json.dumps(row['timestamp'])
+        separator = ','
+    yield ']'
+
+async def stream_ndjson(rows):
+    async for row in rows:
+        yield ndjson_line(row)
+
 @app.get("/logs")
-def read_logs():
-    return database.get_all_logs()
+async def read_logs(
+    request: Request,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+):
+    """Logs in [since, until), oldest first.
+
+    With 'limit' a single page is returned and the 'X-Next-Cursor' header
+    carries the cursor for the next page. Without it the whole range is
+    streamed in chunks, as a JSON array or as NDJSON with format=ndjson.
+    """
+    since = parse_time_bound(since, 'since')
+    until = parse_time_bound(until, 'until')
+    after = parse_cursor(cursor)
+
+    media_type = "application/x-ndjson" if format == "ndjson" else "application/json"
+
+    if limit is None:
+        # Unbounded exports are streamed rather than cached
+        _, headers, not_modified = await validators(request)
+        if not_modified:
+            return Response(status_code=304, headers=headers)
+        rows = async_database.iter_logs(since, until, after)
+        stream = stream_ndjson(rows) if format == "ndjson" else stream_json_array(rows)
+        return StreamingResponse(stream, media_type=media_type, headers=headers)
+
+    async def build():
+        # Fetch one extra row to know whether another page follows
+        rows = await async_database.get_logs_page(since, until, after, limit + 1)
+        headers = {}
+        if len(rows) > limit:
+            rows = rows[:limit]
+            headers["X-Next-Cursor"] = f"{rows[-1]['ts']}.{rows[-1]['id']}"
+
+        if format == "ndjson":
+            return ''.join(ndjson_line(row) for row in rows), headers
+        return json.dumps([row['timestamp'] for row in rows]), headers
+
+    return await cached_response(request, build, media_type=media_type)
 
 @app.post("/log")
-def add_log():
-    database.add_log()
+async def add_log():
+    await async_database.add_log()
     return {"status": "success"}
+
+class LogBatch(BaseModel):
+    timestamps: List[str]
+    dedupe: bool = False
+
+@app.post("/logs/batch")
+async def add_logs(batch: LogBatch):
+    """Logs many ISO 8601 timestamps atomically, e.g. from offline apps or imports."""
+    if len(batch.timestamps) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_SIZE} timestamps per batch")
+    try:
+        inserted = await async_database.add_logs(batch.timestamps, batch.dedupe)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"status": "success", "inserted": inserted, "skipped": len(batch.timestamps) - inserted}
+
+@app.get("/heatmap")
+async def read_heatmap(
+    request: Request,
+    year: Optional[int] = Query(None, ge=1, le=9998),
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+):
+    """Per-day log counts for a calendar year or a [since, until) day range.
+
+    'counts[i]' is the number of logs on 'start' + i days.
+    """
+    if year is not None:
+        since, until = date(year, 1, 1), date(year + 1, 1, 1)
+    elif (since is None) != (until is None):
+        raise HTTPException(status_code=400, detail="Give both 'since' and 'until', or neither")
+    elif since is None:
+        year = date.today().year
+        since, until = date(year, 1, 1), date(year + 1, 1, 1)
+
+    days = (until - since).days
+    if days <= 0 or days > MAX_HEATMAP_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range must cover 1 to {MAX_HEATMAP_DAYS} days")
+
+    async def build():
+        daily = await async_database.get_daily_counts(since, until)
+        counts = [daily.get(since + timedelta(days=i), 0) for i in range(days)]
+        return json.dumps({"start": since.isoformat(), "counts": counts}, separators=(',', ':')), {}
+
+    # Ranges that ended before today only change on backdated imports
+    cache_control = "public, max-age=86400" if until <= date.today() else "no-cache"
+    return await cached_response(request, build, cache_control)
+
+@app.get("/analytics")
+async def read_analytics(request: Request):
+    """Streaks, rolling counts, weekday/hour histograms and year-over-year totals."""
+    # NumPy is only loaded once analytics are first asked for
+    import analytics
+
+    async def build():
+        # CPU-bound NumPy passes: keep them off the event loop
+        return json.dumps(await async_database.run(analytics.compute), separators=(',', ':')), {}
+
+    return await cached_response(request, build)
+
+class EventBroadcaster:
+    """Pushes new logs and updated stats to /events subscribers.
+
+    A single watcher task polls the data version (one pragma) while at
+    least one client is connected, so it sees writes from the button
+    listener process as well as from this one, and costs nothing when
+    no dashboard is open.
+    """
+    def __init__(self):
+        self.subscribers = set()
+        self.task = None
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=16)
+        self.subscribers.add(queue)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.watch())
+        return queue
+
+    def unsubscribe(self, queue):
+        # The watcher exits on its next check once this was the last one
+        self.subscribers.discard(queue)
+
+    def publish(self, event):
+        for queue in list(self.subscribers):
+            if queue.full():
+                # Slow client: drop its backlog and have it refetch
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"reload": True})
+            else:
+                queue.put_nowait(event)
+
+    async def watch(self):
+        version = last_id = None
+        while self.subscribers:
+            try:
+                if version is None:
+                    current, _ = await async_database.get_data_version()
+                    last_id = await async_database.get_last_log_id()
+                    version = current
+                await asyncio.sleep(EVENT_POLL_INTERVAL)
+                current, _ = await async_database.get_data_version()
+                if current == version:
+                    continue
+
+                rows = await async_database.get_logs_after_id(last_id, MAX_EVENT_LOGS + 1)
+                if len(rows) > MAX_EVENT_LOGS:
+                    last_id = await async_database.get_last_log_id()
+                    self.publish({"reload": True})
+                else:
+                    stats = await async_database.get_stats()
+                    if rows:
+                        last_id = rows[-1]['id']
+                    self.publish({
+                        "logs": [{"timestamp": row['timestamp'], "day": row['day']} for row in rows],
+                        "stats": stats,
+                    })
+                version = current
+            except Exception as e:
+                # e.g. 'database is locked' during the nightly VACUUM: the
+                # change is picked up again on the next check
+                logger.warning(f"Event watcher check failed: {e}")
+                await asyncio.sleep(EVENT_POLL_INTERVAL)
+
+broadcaster = EventBroadcaster()
+
+@app.get("/events")
+async def read_events():
+    """Server-sent events: one message per change with the new logs and stats."""
+    queue = broadcaster.subscribe()
+
+    async def stream():
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), EVENT_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            broadcaster.unsubscribe(queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/metrics")
+def read_metrics():
+    """Prometheus text format: this process, plus the device's last published snapshot."""
+    snapshots = [({'process': 'api'}, metrics.snapshot())]
+    device = metrics.load()
+    if device is not None:
+        snapshots.append(({'process': 'device'}, device))
+    return Response(metrics.render_prometheus(snapshots), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,57 @@
+"""Async access to database.py for the API.
+
+Calls run on a small dedicated thread pool instead of Starlette's shared
+one. Each pool thread keeps its own long-lived connection (see
+database.get_db_connection), so the number of threads touching SQLite
+stays at DB_THREADS however many requests are in flight.
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+
+DB_THREADS = int(os.environ.get("HABIT_DB_THREADS", "4"))
+
+_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="habit-db")
+
+async def run(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+async def add_log(timestamp=None):
+    return await run(database.add_log, timestamp)
+
+async def add_logs(timestamps, dedupe=False):
+    return await run(database.add_logs, timestamps, dedupe)
+
+async def get_stats(now=None):
+    return await run(database.get_stats, now)
+
+async def get_data_version():
+    return await run(database.get_data_version)
+
+async def get_logs_page(since=None, until=None, after=None, limit=None):
+    return await run(database.get_logs_page, since, until, after, limit)
+
+async def get_logs_after_id(last_id, limit):
+    return await run(database.get_logs_after_id, last_id, limit)
+
+async def get_last_log_id():
+    return await run(database.get_last_log_id)
+
+async def get_daily_counts(start_day, end_day):
+    return await run(database.get_daily_counts, start_day, end_day)
+
+async def iter_logs(since=None, until=None, after=None, batch_size=1000):
+    while True:
+        rows = await get_logs_page(since, until, after, batch_size)
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            return
+        after = (rows[-1]['ts'], rows[-1]['id'])
+
+def shutdown():
+    _executor.shutdown(wait=True)
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+"""Load benchmark: sync threadpool handlers vs the async database layer.
+
+Drives the ASGI apps in-process with many concurrent simulated clients
+and reports throughput, latency percentiles and the peak number of
+threads. No server or HTTP client library is needed.
+
+    python3 benchmarks/bench_api_load.py --clients 200 --requests 5000
+"""
+import argparse
+import asyncio
+import math
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(ROOT)
+
+import database
+
+async def call(app, path):
+    """Performs one GET against an ASGI app and returns the status code."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+    status = None
+    sent_request = False
+
+    async def receive():
+        nonlocal sent_request
+        if not sent_request:
+            sent_request = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Never disconnect
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+async def run_load(app, path, clients, requests):
+    latencies = []
+    peak_threads = threading.active_count()
+    remaining = requests
+
+    async def client():
+        nonlocal remaining, peak_threads
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            status = await call(app, path)
+            latencies.append(time.perf_counter() - start)
+            peak_threads = max(peak_threads, threading.active_count())
+            if status != 200:
+                raise RuntimeError(f"{path} returned {status}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "rps": requests / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, math.ceil(0.99 * len(latencies)) - 1)] * 1000,
+        "peak_threads": peak_threads,
+    }
+
+def build_sync_app():
+    # The pre-async handler style: sync def, run on Starlette's threadpool
+    from fastapi import FastAPI
+    sync_app = FastAPI()
+
+    @sync_app.get("/stats")
+    def read_stats():
+        return database.get_stats()
+
+    return sync_app
+
+def build_async_app():
+    # Same work through the async layer, without api.py's response cache
+    from fastapi import FastAPI
+    import async_database
+    async_app = FastAPI()
+
+    @async_app.get("/stats")
+    async def read_stats():
+        return await async_database.get_stats()
+
+    return async_app
+
+def seed(count):
+    database.init_db()
+    if database.count_logs() >= count:
+        return
+    now = datetime.now()
+    with database.transaction(write=True):
+        for i in range(count):
+            database.add_log((now - timedelta(hours=7 * i)).isoformat())
+
+def main():
+    parser = argparse.ArgumentParser(description='API load benchmark')
+    parser.add_argument('--clients', type=int, default=100, help='Concurrent clients')
+    parser.add_argument('--requests', type=int, default=3000, help='Requests per run')
+    parser.add_argument('--logs', type=int, default=5000, help='Logs to seed the database with')
+    parser.add_argument('--db', help='Database file (default: a temporary file)')
+    args = parser.parse_args()
+
+    database.DB_FILE = args.db or os.path.join(tempfile.mkdtemp(), "bench.db")
+    seed(args.logs)
+
+    # api.py serves static files relative to the working directory
+    os.chdir(ROOT)
+    import api
+    apps = [
+        ("sync handlers", build_sync_app()),
+        ("async layer", build_async_app()),
+        ("api.app (cached)", api.app),
+    ]
+
+    print(f"{args.clients} clients, {args.requests} requests, {args.logs} logs")
+    for name, app in apps:
+        result = asyncio.run(run_load(app, "/stats", args.clients, args.requests))
+        print(f"  {name:18} {result['rps']:8.0f} req/s  p50 {result['p50_ms']:7.2f} ms  "
+              f"p99 {result['p99_ms']:7.2f} ms  peak threads {result['peak_threads']}")
+
+if __name__ == "__main__":
+    main()
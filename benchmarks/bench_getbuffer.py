@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+"""Micro-benchmark: EPD.getbuffer and clear() buffers, old path vs current.
+
+The old path rotated with resampling, converted to mode '1' and
+allocated a new bytearray per plane; clear() built a list of 0xff ints
+that spidev then had to convert element by element.
+
+    python3 benchmarks/bench_getbuffer.py --number 2000
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+# No panel needed: use the simulated backend unless told otherwise
+os.environ.setdefault('EPD_BACKEND', 'sim')
+
+from PIL import Image, ImageDraw
+
+import epd2in13b_V4
+import tracker
+
+def legacy_getbuffer(epd, image):
+    # EPD.getbuffer as it was before the packing rewrite
+    return bytearray(image.rotate(90, expand=True).convert('1').tobytes('raw'))
+
+def legacy_clear_buffer(epd):
+    linewidth = int(epd.width / 8) + (1 if epd.width % 8 else 0)
+    return [0xff] * (int(linewidth * epd.height))
+
+def stats_like_image(epd):
+    # Landscape 1-bit frame with text and boxes, like draw_stats produces
+    image = Image.new('1', (epd.height, epd.width), 255)
+    draw = ImageDraw.Draw(image)
+    draw.text((40, 20), "Keep it up!", font=tracker.get_font(28), fill=0)
+    for i in range(3):
+        x = 10 + i * 80
+        draw.rectangle([x, 60, x + 70, 112], outline=0, width=1)
+        draw.text((x + 20, 80), str(123 * (i + 1)), font=tracker.get_font(24), fill=0)
+    return image
+
+def main():
+    parser = argparse.ArgumentParser(description='getbuffer micro-benchmark')
+    parser.add_argument('--number', type=int, default=2000, help='Iterations per case')
+    args = parser.parse_args()
+
+    epd = epd2in13b_V4.EPD()
+    image = stats_like_image(epd)
+    assert legacy_getbuffer(epd, image) == epd.getbuffer(image, 0), "packed output differs"
+
+    cases = [
+        ("getbuffer (old)", lambda: legacy_getbuffer(epd, image)),
+        ("getbuffer (plane)", lambda: epd.getbuffer(image, 0)),
+        ("clear buffer (old list)", lambda: legacy_clear_buffer(epd)),
+        ("clear buffer (shared bytes)", lambda: epd.white),
+    ]
+    for name, func in cases:
+        seconds = timeit.timeit(func, number=args.number) / args.number
+        print(f"  {name:28} {seconds * 1e6:8.1f} us")
+
+if __name__ == "__main__":
+    main()
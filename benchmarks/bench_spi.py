@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+"""Counts SPI transactions, bytes and GPIO writes for a display cycle.
+
+Installs a counting mock in place of the epdconfig hardware functions
+and runs init() + display() + sleep() with the current driver and with
+the old byte-at-a-time command path, so the difference is measurable
+without a panel attached.
+
+    python3 benchmarks/bench_spi.py
+"""
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+# No panel needed: use the simulated backend unless told otherwise
+os.environ.setdefault('EPD_BACKEND', 'sim')
+
+import epdconfig
+import epd2in13b_V4
+
+class MockBackend:
+    """Stands in for the epdconfig hardware functions and counts calls."""
+    def __init__(self):
+        self.transactions = 0
+        self.bytes = 0
+        self.gpio_writes = 0
+
+    def digital_write(self, pin, value):
+        self.gpio_writes += 1
+
+    def digital_read(self, pin):
+        return 0
+
+    def delay_ms(self, delaytime):
+        pass
+
+    def spi_writebyte(self, data):
+        self.transactions += 1
+        self.bytes += len(data)
+
+    def spi_writebyte2(self, data):
+        for start in range(0, len(data), epdconfig.SPI_CHUNK_SIZE):
+            self.transactions += 1
+            self.bytes += len(data[start:start + epdconfig.SPI_CHUNK_SIZE])
+
+    def module_init(self):
+        return 0
+
+    def module_exit(self):
+        pass
+
+    def install(self):
+        for name in ('digital_write', 'digital_read', 'delay_ms', 'spi_writebyte',
+                     'spi_writebyte2', 'module_init', 'module_exit'):
+            setattr(epdconfig, name, getattr(self, name))
+
+class LegacyEPD(epd2in13b_V4.EPD):
+    """The driver's command path before parameters were batched."""
+    def send_command(self, command, data=None):
+        epdconfig.digital_write(self.dc_pin, 0)
+        epdconfig.digital_write(self.cs_pin, 0)
+        epdconfig.spi_writebyte([command])
+        epdconfig.digital_write(self.cs_pin, 1)
+        for byte in data or ():
+            self.send_data(byte)
+
+    def send_data(self, data):
+        epdconfig.digital_write(self.dc_pin, 1)
+        epdconfig.digital_write(self.cs_pin, 0)
+        epdconfig.spi_writebyte([data])
+        epdconfig.digital_write(self.cs_pin, 1)
+
+    def send_data2(self, data):
+        epdconfig.digital_write(self.dc_pin, 1)
+        epdconfig.digital_write(self.cs_pin, 0)
+        epdconfig.spi_writebyte2(data)
+        epdconfig.digital_write(self.cs_pin, 1)
+
+    def set_windows(self, xstart, ystart, xend, yend):
+        self.send_command(0x44)
+        self.send_data((xstart>>3) & 0xff)
+        self.send_data((xend>>3) & 0xff)
+        self.send_command(0x45)
+        self.send_data(ystart & 0xff)
+        self.send_data((ystart >> 8) & 0xff)
+        self.send_data(yend & 0xff)
+        self.send_data((yend >> 8) & 0xff)
+
+    def set_cursor(self, xstart, ystart):
+        self.send_command(0x4E)
+        self.send_data(xstart & 0xff)
+        self.send_command(0x4F)
+        self.send_data(ystart & 0xff)
+        self.send_data((ystart >> 8) & 0xff)
+
+    def init(self):
+        epdconfig.module_init()
+        self.reset()
+        self.busy()
+        self.send_command(0x12)
+        self.busy()
+        self.send_command(0x01)
+        self.send_data(0xf9)
+        self.send_data(0x00)
+        self.send_data(0x00)
+        self.send_command(0x11)
+        self.send_data(0x03)
+        self.set_windows(0, 0, self.width - 1, self.height - 1)
+        self.set_cursor(0, 0)
+        self.send_command(0x3C)
+        self.send_data(0x05)
+        self.send_command(0x18)
+        self.send_data(0x80)
+        self.send_command(0x21)
+        self.send_data(0x80)
+        self.send_data(0x80)
+        self.busy()
+        return 0
+
+    def sleep(self):
+        self.send_command(0x10)
+        self.send_data(0x01)
+        epdconfig.delay_ms(2000)
+        epdconfig.module_exit()
+
+def measure(epd_class):
+    backend = MockBackend()
+    backend.install()
+    epd = epd_class()
+    frame = bytes(epd.plane_size)
+
+    start = time.perf_counter()
+    epd.init()
+    epd.display(frame, epd.white)
+    epd.sleep()
+    elapsed = time.perf_counter() - start
+    return backend, elapsed
+
+def main():
+    print(f"SPI chunk size {epdconfig.SPI_CHUNK_SIZE}, clock {epdconfig.SPI_SPEED_HZ} Hz")
+    for name, epd_class in (("old", LegacyEPD), ("current", epd2in13b_V4.EPD)):
+        backend, elapsed = measure(epd_class)
+        print(f"  {name:8} {backend.transactions:4} SPI transactions  {backend.bytes:5} bytes  "
+              f"{backend.gpio_writes:4} GPIO writes  {elapsed * 1000:.2f} ms host time")
+
+if __name__ == "__main__":
+    main()
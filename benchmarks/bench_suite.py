@@ -0,0 +1,246 @@
+#!/usr/bin/python3
+"""Benchmark suite: stats, database and rendering hot paths vs history size.
+
+Fills a database per size with a seeded, realistic history (presses
+cluster around morning and evening, fewer at weekends, with skipped
+weeks) and times each hot path in isolation. Reports throughput,
+latency percentiles and peak Python memory. Results can be saved as a
+JSON baseline and later runs compared against it; regressions beyond
+the threshold are listed and make the script exit with status 1.
+Runs headless on the simulated panel backend.
+
+    python3 benchmarks/bench_suite.py --sizes 1000,10000,100000 --save baseline.json
+    python3 benchmarks/bench_suite.py --sizes 1000,10000,100000 --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(ROOT)
+# No panel needed: use the simulated backend unless told otherwise
+os.environ.setdefault('EPD_BACKEND', 'sim')
+
+import database
+
+DEFAULT_SIZES = "1000,10000,100000"
+
+# Metrics compared against a baseline: (key, True if higher is worse)
+COMPARED = (("p50_ms", True), ("peak_kib", True))
+
+def generate_history(count, seed=0, end=None):
+    """Returns count sorted ISO timestamps spread over the past years.
+
+    About a tenth of the weeks are skipped entirely, so streaks break now
+    and then. The span grows with count, up to 10 years, the density
+    growing after that.
+    """
+    rng = random.Random(seed)
+    end = end or datetime.now().replace(microsecond=0)
+    days = max(7, min(3650, count // 2))
+    weeks = days // 7 + 1
+    skipped = {w for w in range(1, weeks) if rng.random() < 0.1}
+    # Weekday weights, Monday first
+    weekday_weights = (1.0, 1.0, 1.0, 1.0, 0.9, 0.6, 0.5)
+
+    history = []
+    while len(history) < count:
+        day = rng.randrange(days)
+        if day // 7 in skipped:
+            continue
+        date = end - timedelta(days=day)
+        if rng.random() > weekday_weights[date.weekday()]:
+            continue
+        hour = rng.gauss(7.5, 1.0) if rng.random() < 0.4 else rng.gauss(18.5, 2.0)
+        hour = min(max(hour, 0.0), 23.99)
+        moment = date.replace(hour=0, minute=0, second=0) + timedelta(seconds=int(hour * 3600))
+        if moment <= end:
+            history.append(moment)
+    history.sort()
+    return [moment.isoformat() for moment in history]
+
+def seed_database(path, history):
+    """Creates (or reuses) a database file holding exactly history."""
+    database.close_db_connection()
+    database.DB_FILE = path
+    database.init_db()
+    if database.count_logs() == len(history):
+        return
+    database.close_db_connection()
+    os.remove(path)
+    database.init_db()
+    for start in range(0, len(history), 50000):
+        with database.transaction(write=True):
+            database.add_logs(history[start:start + 50000])
+
+def scratch_copy(path):
+    """Returns a copy of the database at path for cases that write to it."""
+    copy = f"{path}.scratch"
+    target = sqlite3.connect(copy)
+    database.get_db_connection().backup(target)
+    target.close()
+    return copy
+
+def remove_database(path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+def measure(func, min_time, max_runs):
+    """Times func repeatedly, then once more under tracemalloc."""
+    func()  # warm-up
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < max_runs and (not timings or time.perf_counter() - started < min_time):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "runs": len(timings),
+        "ops_per_s": len(timings) / sum(timings),
+        "p50_ms": statistics.median(timings) * 1000,
+        "p95_ms": timings[min(len(timings) - 1, math.ceil(0.95 * len(timings)) - 1)] * 1000,
+        "peak_kib": peak / 1024,
+    }
+
+def build_cases(history, state_dir):
+    """Returns (name, callable, writes) for the current database.
+
+    Cases that write are run against a scratch copy, so every case and
+    size sees exactly the seeded history.
+    """
+    import stats
+    import tracker
+    import epd2in13b_V4
+    from bench_api_load import call
+
+    # Keep the benchmark away from the device's panel state and frame cache
+    tracker.PANEL_STATE_FILE = os.path.join(state_dir, "panel_state")
+    tracker.FRAME_CACHE_DIR = None
+
+    os.chdir(ROOT)
+    import api
+
+    epd = epd2in13b_V4.EPD()
+    image_black, _ = tracker.render_stats(epd)
+    device = tracker.HabitTracker(idle_timeout=None)
+
+    def api_stats():
+        # Forget cached responses so each call does the full handler
+        api._response_cache.clear()
+        asyncio.run(call(api.app, "/stats"))
+
+    return [
+        ("stats.get_weekly_volume", lambda: stats.get_weekly_volume(history), False),
+        ("stats.get_weekly_streak", lambda: stats.get_weekly_streak(history), False),
+        ("database.get_all_logs", database.get_all_logs, False),
+        ("database.get_stats", database.get_stats, False),
+        ("database.add_log", database.add_log, True),
+        ("api /stats", api_stats, False),
+        ("tracker.render_stats", lambda: tracker.render_stats(epd), False),
+        ("EPD.getbuffer", lambda: epd.getbuffer(image_black, 0), False),
+        ("press (sim panel)", lambda: device.update(), True),
+    ]
+
+def compare(results, baseline, threshold):
+    """Lists metrics that got worse than baseline by more than threshold."""
+    regressions = []
+    for size, cases in results.items():
+        for name, result in cases.items():
+            old = baseline.get("results", {}).get(size, {}).get(name)
+            if not old:
+                continue
+            for key, higher_is_worse in COMPARED:
+                if not old.get(key):
+                    continue
+                change = result[key] / old[key] - 1
+                if (change if higher_is_worse else -change) > threshold:
+                    regressions.append(f"{size} logs, {name}: {key} {old[key]:.3f} -> {result[key]:.3f} ({change:+.0%})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Hot path benchmark suite')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='Comma-separated history sizes (up to 1000000)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the generated histories')
+    parser.add_argument('--only', help='Run only cases whose name contains this text')
+    parser.add_argument('--min-time', type=float, default=0.5, help='Seconds spent timing each case')
+    parser.add_argument('--max-runs', type=int, default=1000, help='Timed runs per case at most')
+    parser.add_argument('--db-dir', help='Where generated databases are kept (default: a temporary directory)')
+    parser.add_argument('--save', help='Write results to this JSON file')
+    parser.add_argument('--compare', help='Baseline JSON file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.25, help='Allowed slowdown before flagging, as a fraction')
+    args = parser.parse_args()
+
+    db_dir = args.db_dir or tempfile.mkdtemp()
+    os.makedirs(db_dir, exist_ok=True)
+    results = {}
+
+    for size in (int(s) for s in args.sizes.split(',')):
+        history = generate_history(size, args.seed)
+        started = time.perf_counter()
+        seed_database(os.path.join(db_dir, f"bench_{size}_{args.seed}.db"), history)
+        print(f"{size} logs (database ready in {time.perf_counter() - started:.1f} s)")
+
+        seeded = database.DB_FILE
+        results[str(size)] = {}
+        for name, func, writes in build_cases(history, db_dir):
+            if args.only and args.only not in name:
+                continue
+            if writes:
+                database.DB_FILE = scratch_copy(seeded)
+            try:
+                result = measure(func, args.min_time, args.max_runs)
+            finally:
+                if writes:
+                    database.close_db_connection()
+                    remove_database(database.DB_FILE)
+                    database.DB_FILE = seeded
+            results[str(size)][name] = result
+            print(f"  {name:28} {result['ops_per_s']:10.1f} ops/s  p50 {result['p50_ms']:9.3f} ms  "
+                  f"p95 {result['p95_ms']:9.3f} ms  peak {result['peak_kib']:9.1f} KiB")
+
+    report = {
+        "meta": {
+            "created": datetime.now().isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved results to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"Regressions against {args.compare}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions against {args.compare} (threshold {args.threshold:.0%})")
+
+if __name__ == "__main__":
+    main()
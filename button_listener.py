@@ -1,16 +1,22 @@
 #!/usr/bin/python3
-import RPi.GPIO as GPIO
 import time
 import os
 import sys
 import logging
 import threading
 import datetime
-from threading import Timer
+import queue
+import functools
+import sqlite3
 
 # Add current directory to path to import tracker
 sys.path.append(os.path.dirname(os.path.realpath(__file__)))
-from tracker import HabitTracker
+from tracker import HabitTracker, PANEL_IDLE_TIMEOUT
+# RPi.GPIO on the device, SimGPIO under EPD_BACKEND=sim
+from epdconfig import GPIO
+from scheduler import Scheduler
+import database
+import metrics
 
 # Configuration
 BUTTON_PIN = 5  # BCM
@@ -19,23 +25,14 @@ LED_PIN = 6     # BCM
 # Constants
 LONG_PRESS_DURATION = 3.0  # Seconds
 STATS_DURATION = 15.0      # Seconds
+DEBOUNCE_TIME = 0.05       # Seconds an edge must hold before it counts as a press
+# Seconds between metrics summary lines (also saved for the API's /metrics)
+METRICS_INTERVAL = float(os.environ.get('HABIT_METRICS_INTERVAL', '300'))
 
 # Logging setup
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def flash_led(times=3, interval=0.1):
-    """Flashes the LED in a separate thread."""
-    def _flash():
-        for _ in range(times):
-            GPIO.output(LED_PIN, GPIO.HIGH)
-            time.sleep(interval)
-            GPIO.output(LED_PIN, GPIO.LOW)
-            time.sleep(interval)
-        # Leave LED ON after flashing
-        GPIO.output(LED_PIN, GPIO.HIGH)
-    threading.Thread(target=_flash).start()
-
 def get_seconds_until_3am():
     """Calculates seconds until the next 3:00 AM."""
     now = datetime.datetime.now()
@@ -44,11 +41,76 @@ def get_seconds_until_3am():
         next_3am += datetime.timedelta(days=1)
     return (next_3am - now).total_seconds()
 
+class DisplayWorker:
+    """Runs panel refreshes on one thread, newest request first.
+
+    A refresh takes ~15 seconds. Requests arriving meanwhile replace each
+    other, so only the latest screen is drawn once the panel is free.
+    on_idle runs on the same thread once idle_timeout seconds pass after
+    a refresh with nothing queued, so powering down never overlaps one.
+    """
+    def __init__(self, idle_timeout=None, on_idle=None):
+        self.cond = threading.Condition()
+        self.pending = None
+        self.running = True
+        self.idle_timeout = idle_timeout
+        self.on_idle = on_idle
+        self.thread = threading.Thread(target=self._run, name='display', daemon=True)
+        self.thread.start()
+
+    def request(self, action):
+        with self.cond:
+            if self.pending is not None:
+                logger.info("Display busy, replacing queued refresh")
+            self.pending = action
+            self.cond.notify()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.pending = None
+            self.cond.notify()
+        self.thread.join()
+
+    def _run(self):
+        idle_due = False
+        while True:
+            with self.cond:
+                while self.running and self.pending is None:
+                    timeout = self.idle_timeout if idle_due else None
+                    if not self.cond.wait(timeout):
+                        break
+                if not self.running:
+                    return
+                action, self.pending = self.pending, None
+            if action is None:
+                # Idle timeout elapsed
+                action, idle_due = self.on_idle, False
+            else:
+                idle_due = self.on_idle is not None
+            try:
+                action()
+            except Exception as e:
+                logger.error(f"Display refresh failed: {e}", exc_info=True)
+
 class HabitController:
     def __init__(self):
-        self.tracker = HabitTracker()
-        self.timer = None
-        self.reset_timer = None
+        # The display worker powers the panel down, not the tracker's own timer
+        self.tracker = HabitTracker(idle_timeout=None)
+        # All timed actions (LED patterns, screen transitions, daily reset)
+        # run on the scheduler thread; panel refreshes on the display worker
+        self.scheduler = Scheduler()
+        self.done_call = None
+        self.reset_call = None
+        # Presses handled so far; tags stats refreshes so only the latest
+        # one starts the countdown to the done screen
+        self.presses = 0
+        self.led_calls = []
+        self.maintenance = None
+        # Presses from the GPIO callback thread, consumed by run()
+        self.events = queue.Queue()
+        self.last_press = 0.0
+        self.display = DisplayWorker(PANEL_IDLE_TIMEOUT, self.tracker.sleep)
         
         # Setup GPIO
         GPIO.setmode(GPIO.BCM)
@@ -57,68 +119,143 @@ class HabitController:
         GPIO.output(LED_PIN, GPIO.HIGH) # LED ON for WYAO
         
         # Start 3AM Scheduler
-        self.schedule_reset()
+        self.scheduler.call_soon(self.schedule_reset)
+        self.scheduler.call_later(METRICS_INTERVAL, self.report_metrics)
         
         # Initial State
-        self.tracker.initialize()
+        self.display.request(self.tracker.initialize)
+
+        # Falling edge = press (Active Low)
+        GPIO.add_event_detect(BUTTON_PIN, GPIO.FALLING, callback=self.on_edge)
+
+    def on_edge(self, channel):
+        """GPIO callback: debounces the edge and queues a press."""
+        now = time.monotonic()
+        if now - self.last_press < DEBOUNCE_TIME:
+            return
+        # Ignore glitches that do not hold the line low
+        time.sleep(DEBOUNCE_TIME)
+        if GPIO.input(BUTTON_PIN) != GPIO.LOW:
+            return
+        # Bounces delivered while we waited fall inside the window
+        self.last_press = time.monotonic()
+        self.events.put(datetime.datetime.now())
+
+    # The methods below run on the scheduler thread
+
+    def set_led(self, level):
+        """Sets the LED, stopping any pattern in progress."""
+        for call in self.led_calls:
+            call.cancel()
+        self.led_calls = []
+        GPIO.output(LED_PIN, level)
+
+    def flash_led(self, times=3, interval=0.1):
+        """Flashes the LED, then leaves it ON."""
+        steps = [GPIO.HIGH, GPIO.LOW] * times + [GPIO.HIGH]
+        self.set_led(steps[0])
+        self.led_calls = [self.scheduler.call_later(i * interval, GPIO.output, LED_PIN, level)
+                          for i, level in enumerate(steps[1:], 1)]
 
     def schedule_reset(self):
         """Schedules the daily reset at 3am."""
         seconds = get_seconds_until_3am()
         logger.info(f"Scheduling reset in {seconds} seconds")
-        self.reset_timer = threading.Timer(seconds, self.daily_reset)
-        self.reset_timer.start()
+        self.reset_call = self.scheduler.call_later(seconds, self.daily_reset)
 
     def daily_reset(self):
         """Resets the display to WYAO and reschedules."""
         logger.info("Executing Daily Reset...")
-        GPIO.output(LED_PIN, GPIO.HIGH) # Turn LED ON
-        self.tracker.initialize()
+        self.set_led(GPIO.HIGH) # Turn LED ON
+        self.display.request(self.tracker.initialize)
         self.schedule_reset()
+        # Compaction and VACUUM can take a while: keep them off this thread
+        if self.maintenance is not None and self.maintenance.is_alive():
+            logger.warning("Maintenance still running, skipping this one")
+        else:
+            self.maintenance = threading.Thread(target=self.run_maintenance, name='maintenance', daemon=True)
+            self.maintenance.start()
+
+    def run_maintenance(self):
+        """Rolls up old logs per the retention policy and vacuums the database."""
+        try:
+            removed, freed = database.run_maintenance()
+        except sqlite3.Error as e:
+            logger.error(f"Maintenance failed: {e}", exc_info=True)
+            return
+        logger.info(f"Maintenance: rolled up {removed} logs, freed {freed} pages")
 
     def show_done_screen(self):
         """Shows the 'You did it' screen."""
-        GPIO.output(LED_PIN, GPIO.LOW) # Turn LED OFF immediately
-        self.tracker.draw_done_screen()
+        self.done_call = None
+        self.set_led(GPIO.LOW) # Turn LED OFF immediately
+        self.display.request(self.tracker.draw_done_screen)
+
+    def report_metrics(self, reschedule=True):
+        """Logs a metrics summary and publishes it for the API's /metrics."""
+        logger.info(f"Metrics: {metrics.summary(metrics.snapshot())}")
+        try:
+            metrics.save()
+        except OSError as e:
+            logger.warning(f"Could not save metrics: {e}")
+        if reschedule:
+            self.scheduler.call_later(METRICS_INTERVAL, self.report_metrics)
 
-    def handle_press(self):
+    def press_feedback(self):
+        """Flashes the LED and stops any countdown to the done screen."""
+        self.flash_led(5) # Flash 5 times as requested
+        if self.done_call:
+            self.done_call.cancel()
+            self.done_call = None
+
+    def start_done_countdown(self, press):
+        """Shows the done screen STATS_DURATION after the stats for press are up."""
+        # A later press has its own stats refresh coming, which restarts this
+        if press != self.presses:
+            return
+        if self.done_call:
+            self.done_call.cancel()
+        self.done_call = self.scheduler.call_later(STATS_DURATION, self.show_done_screen)
+
+    def handle_press(self, pressed_at):
         """Log habit, show stats, then show done screen."""
         logger.info("Button Pressed: Logging Habit")
-        flash_led(5) # Flash 5 times as requested
-        
-        # 1. Log and Show Stats
-        self.tracker.update()
         
-        # 2. Schedule transition to 'Done' screen
-        if self.timer:
-            self.timer.cancel()
-        self.timer = threading.Timer(STATS_DURATION, self.show_done_screen)
-        self.timer.start()
+        # Log now, show stats when the panel is free
+        try:
+            database.add_log(pressed_at.isoformat())
+        except sqlite3.Error as e:
+            # e.g. still locked by maintenance after busy_timeout; keep
+            # listening, and leave the LED and screen as they were
+            logger.error(f"Could not log press at {pressed_at.isoformat()}: {e}")
+            return
+        self.presses += 1
+        self.scheduler.call_soon(self.press_feedback)
+        metrics.inc('presses')
+        self.display.request(functools.partial(self.show_stats, self.presses, time.monotonic()))
+
+    def show_stats(self, press, pressed):
+        # Runs on the display worker; coalesced presses time the latest one
+        self.tracker.draw_stats()
+        metrics.observe('press_to_stats', time.monotonic() - pressed)
+        # The stats stay up for STATS_DURATION from now, not from the press
+        self.scheduler.call_soon(self.start_done_countdown, press)
 
     def run(self):
         logger.info("Button Listener Started...")
         try:
             while True:
-                # Wait for button press (Active Low)
-                if GPIO.input(BUTTON_PIN) == False:
-                    # Debounce
-                    time.sleep(0.05)
-                    if GPIO.input(BUTTON_PIN) == False:
-                        self.handle_press()
-                        
-                        # Wait for release to avoid multiple triggers
-                        while GPIO.input(BUTTON_PIN) == False:
-                            time.sleep(0.1)
-                            
-                time.sleep(0.1) # Polling rate
+                # Blocks until the GPIO callback queues a press
+                self.handle_press(self.events.get())
                 
         except KeyboardInterrupt:
             logger.info("Exiting...")
         finally:
-            if self.timer:
-                self.timer.cancel()
-            if self.reset_timer:
-                self.reset_timer.cancel()
+            GPIO.remove_event_detect(BUTTON_PIN)
+            self.scheduler.stop()
+            self.report_metrics(reschedule=False)
+            self.display.stop()
+            self.tracker.sleep()
             GPIO.cleanup()
 
 if __name__ == "__main__":
@@ -1,69 +1,725 @@
 import sqlite3
 import os
-from datetime import datetime
+import argparse
+import calendar
+import threading
+import time
+import itertools
+from array import array
+from contextlib import contextmanager
+from collections import Counter
+from datetime import datetime, date, timedelta
+
+import metrics
 
 DB_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "habit.db")
 
+# Applied to every new connection. WAL lets the API read while the
+# button listener writes; NORMAL sync is durable enough in WAL mode.
+# auto_vacuum only takes effect on a new database (see vacuum()).
+PRAGMAS = (
+    ('auto_vacuum', 'INCREMENTAL'),
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -4096),        # KiB
+    ('mmap_size', 32 * 1024 * 1024),
+    ('busy_timeout', 5000),       # ms
+    ('temp_store', 'MEMORY'),
+)
+
+# How far past the current time add_logs() accepts a timestamp, for
+# clients whose clocks run slightly ahead
+MAX_FUTURE_SKEW = timedelta(minutes=5)
+
+# Rows backfilled per statement batch when migrating old databases
+BACKFILL_BATCH_SIZE = 5000
+
+# Retention: logs older than this many months are rolled up into per-day
+# or per-week counts by run_maintenance() (0 keeps every log)
+RETENTION_MONTHS = int(os.environ.get('HABIT_RETENTION_MONTHS', '0'))
+ROLLUP_GRANULARITY = os.environ.get('HABIT_ROLLUP', 'day')
+# Days of logs rolled up per write transaction (a multiple of 7)
+COMPACT_BATCH_DAYS = 28
+
+# One long-lived connection per thread (and per process, in case of fork)
+_local = threading.local()
+
 def get_db_connection():
-    conn = sqlite3.connect(DB_FILE)
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid() and _local.path == DB_FILE:
+        return conn
+
+    # isolation_level=None: transactions are opened explicitly by transaction()
+    conn = sqlite3.connect(DB_FILE, isolation_level=None)
     conn.row_factory = sqlite3.Row
+    # Counts every statement run, including BEGIN/COMMIT
+    conn.set_trace_callback(_count_statement)
+    for name, value in PRAGMAS:
+        conn.execute(f'PRAGMA {name} = {value}')
+
+    _local.conn = conn
+    _local.pid = os.getpid()
+    _local.path = DB_FILE
+    _local.data_version = None
     return conn
 
-def init_db():
+def _count_statement(sql):
+    metrics.inc('db_statements')
+
+def close_db_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid():
+        conn.close()
+    _local.conn = None
+
+@contextmanager
+def transaction(write=False):
+    """Yields a cursor inside a transaction on this thread's connection.
+
+    Write transactions take the write lock up front (BEGIN IMMEDIATE) so
+    they never fail half way through on a lock upgrade. Nested calls join
+    the outer transaction.
+    """
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Create logs table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL
+    if conn.in_transaction:
+        yield conn.cursor()
+        return
+
+    conn.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+    try:
+        yield conn.cursor()
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+    if write:
+        # PRAGMA data_version does not see this connection's own commits
+        _local.data_version = None
+
+def init_db():
+    with transaction(write=True) as cursor:
+        # Create logs table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT NOT NULL
+            )
+        ''')
+
+        # Create meta table for offset and other config
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+
+        # Per ISO week log counts, maintained by add_log
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS weekly_counts (
+                year INTEGER NOT NULL,
+                week INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (year, week)
+            )
+        ''')
+
+        # Counts of logs removed by compact_logs(), keyed by the first
+        # local day they cover: 'days' is 1, or 7 for a weekly rollup keyed
+        # on its Monday. Stats add them to the remaining logs; per-day
+        # queries only add daily ones.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS rollups (
+                day TEXT PRIMARY KEY,
+                yearweek INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                days INTEGER NOT NULL DEFAULT 1
+            )
+        ''')
+
+        _migrate_schema(cursor)
+
+        # Databases created before the aggregates existed need one full pass
+        if _get_meta(cursor, 'total_logs') is None:
+            _store_aggregates(cursor, *_compute_aggregates(cursor))
+
+def _migrate_schema(cursor):
+    # Schema version is tracked in SQLite's user_version header field
+    version = cursor.execute('PRAGMA user_version').fetchone()[0]
+
+    if version < 1:
+        # Typed timestamp columns: epoch seconds, local date and ISO year-week
+        columns = {row['name'] for row in cursor.execute('PRAGMA table_info(logs)')}
+        for name, kind in (('ts', 'INTEGER'), ('day', 'TEXT'), ('yearweek', 'INTEGER')):
+            if name not in columns:
+                cursor.execute(f'ALTER TABLE logs ADD COLUMN {name} {kind}')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_logs_ts ON logs (ts)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_logs_day ON logs (day)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_logs_yearweek ON logs (yearweek)')
+        _backfill_timestamps(cursor)
+        cursor.execute('PRAGMA user_version = 1')
+
+    if version < 2:
+        # Rewrite timestamps stored in other ISO 8601 forms in isoformat(),
+        # with columns derived from local time; the aggregates follow them
+        if _normalize_timestamps(cursor):
+            if _get_meta(cursor, 'total_logs') is not None:
+                _store_aggregates(cursor, *_compute_aggregates(cursor))
+            _bump_data_version(cursor)
+        cursor.execute('PRAGMA user_version = 2')
+
+    if version < 3:
+        # Rollups tables from before 'days' existed hold daily rollups
+        # unless compacted with HABIT_ROLLUP=week
+        columns = {row['name'] for row in cursor.execute('PRAGMA table_info(rollups)')}
+        if 'days' not in columns:
+            cursor.execute('ALTER TABLE rollups ADD COLUMN days INTEGER NOT NULL DEFAULT 1')
+            if ROLLUP_GRANULARITY == 'week':
+                cursor.execute('UPDATE rollups SET days = 7')
+        cursor.execute('PRAGMA user_version = 3')
+
+def _backfill_timestamps(cursor):
+    while True:
+        cursor.execute('SELECT id, timestamp FROM logs WHERE ts IS NULL LIMIT ?', (BACKFILL_BATCH_SIZE,))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        cursor.executemany(
+            'UPDATE logs SET ts = ?, day = ?, yearweek = ? WHERE id = ?',
+            [_log_columns(_parse_timestamp(row['timestamp'])[1]) + (row['id'],) for row in rows]
         )
-    ''')
-    
-    # Create meta table for offset and other config
+
+def _normalize_timestamps(cursor):
+    # Returns the number of rows rewritten
+    last_id = 0
+    changed = 0
+    while True:
+        cursor.execute('SELECT id, timestamp, ts, day, yearweek FROM logs WHERE id > ? ORDER BY id LIMIT ?',
+                       (last_id, BACKFILL_BATCH_SIZE))
+        rows = cursor.fetchall()
+        if not rows:
+            return changed
+        last_id = rows[-1]['id']
+        updates = []
+        for row in rows:
+            timestamp, dt = _parse_timestamp(row['timestamp'])
+            values = (timestamp,) + _log_columns(dt)
+            if values != (row['timestamp'], row['ts'], row['day'], row['yearweek']):
+                updates.append(values + (row['id'],))
+        cursor.executemany('UPDATE logs SET timestamp = ?, ts = ?, day = ?, yearweek = ? WHERE id = ?', updates)
+        changed += len(updates)
+
+def _log_columns(dt):
+    # (ts, day, yearweek) values stored alongside the raw timestamp
+    year, week = _iso_week(dt)
+    return int(dt.timestamp()), dt.date().isoformat(), year * 100 + week
+
+def _to_epoch(value):
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return int(value.timestamp())
+
+def _epoch_bounds(since, until):
+    # Half-open [since, until) range; bounds may be epoch ints, datetimes or ISO strings
+    low = _to_epoch(since) if since is not None else -2**63
+    high = _to_epoch(until) if until is not None else 2**63 - 1
+    return low, high
+
+def _get_meta(cursor, key):
+    cursor.execute('SELECT value FROM meta WHERE key = ?', (key,))
+    row = cursor.fetchone()
+    if row:
+        return row['value']
+    return None
+
+def _set_meta(cursor, key, value):
+    cursor.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+def _bump_data_version(cursor):
+    # Called by every write that changes what readers would see
+    version = int(_get_meta(cursor, 'data_version') or 0) + 1
+    _set_meta(cursor, 'data_version', version)
+    _set_meta(cursor, 'data_modified', time.time())
+
+def _iso_week(dt):
+    year, week, _ = dt.isocalendar()
+    return year, week
+
+def _previous_week(year, week):
+    monday = date.fromisocalendar(year, week, 1)
+    return _iso_week(monday - timedelta(days=7))
+
+def _format_week(year, week):
+    return f"{year}-W{week:02d}"
+
+def _parse_week(value):
+    year, week = value.split('-W')
+    return int(year), int(week)
+
+def _streak_ending_at(weeks, last_week):
+    # Length of the run of consecutive active weeks ending at last_week
+    streak = 0
+    check = last_week
+    while check in weeks:
+        streak += 1
+        check = _previous_week(*check)
+    return streak
+
+def _record_log(cursor, dt):
+    # Keep the aggregates in step with a freshly inserted log row
+    year, week = _iso_week(dt)
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS meta (
-            key TEXT PRIMARY KEY,
-            value TEXT
-        )
+        INSERT INTO weekly_counts (year, week, count) VALUES (?, ?, 1)
+        ON CONFLICT (year, week) DO UPDATE SET count = count + 1
+    ''', (year, week))
+    cursor.execute('SELECT count FROM weekly_counts WHERE year = ? AND week = ?', (year, week))
+    new_week = cursor.fetchone()['count'] == 1
+
+    total = int(_get_meta(cursor, 'total_logs') or 0)
+    _set_meta(cursor, 'total_logs', total + 1)
+
+    if not new_week:
+        return
+
+    last = _get_meta(cursor, 'streak_week')
+    if last is None:
+        _set_meta(cursor, 'streak_week', _format_week(year, week))
+        _set_meta(cursor, 'streak_length', 1)
+        return
+
+    last_week = _parse_week(last)
+    if (year, week) > last_week:
+        if _previous_week(year, week) == last_week:
+            streak = int(_get_meta(cursor, 'streak_length')) + 1
+        else:
+            streak = 1
+        _set_meta(cursor, 'streak_week', _format_week(year, week))
+        _set_meta(cursor, 'streak_length', streak)
+    else:
+        # A backdated log may have bridged a gap in the current run
+        cursor.execute('SELECT year, week FROM weekly_counts')
+        weeks = {(row['year'], row['week']) for row in cursor.fetchall()}
+        _set_meta(cursor, 'streak_length', _streak_ending_at(weeks, last_week))
+
+def _record_logs(cursor, first_id):
+    # Bulk version of _record_log for every row inserted after first_id
+    cursor.execute('SELECT yearweek, COUNT(*) AS count FROM logs WHERE id > ? GROUP BY yearweek', (first_id,))
+    week_counts = [(row['yearweek'] // 100, row['yearweek'] % 100, row['count']) for row in cursor.fetchall()]
+    if not week_counts:
+        return 0
+
+    cursor.executemany('''
+        INSERT INTO weekly_counts (year, week, count) VALUES (?, ?, ?)
+        ON CONFLICT (year, week) DO UPDATE SET count = count + excluded.count
+    ''', week_counts)
+    inserted = sum(count for _, _, count in week_counts)
+    total = int(_get_meta(cursor, 'total_logs') or 0)
+    _set_meta(cursor, 'total_logs', total + inserted)
+
+    # New weeks can extend or bridge the run, so recount it
+    cursor.execute('SELECT year, week FROM weekly_counts')
+    weeks = {(row['year'], row['week']) for row in cursor.fetchall()}
+    last_week = max(weeks)
+    _set_meta(cursor, 'streak_week', _format_week(*last_week))
+    _set_meta(cursor, 'streak_length', _streak_ending_at(weeks, last_week))
+    return inserted
+
+def _compute_aggregates(cursor):
+    week_counts = Counter()
+    total = 0
+    cursor.execute('''
+        SELECT yearweek, SUM(count) AS count FROM (
+            SELECT yearweek, COUNT(*) AS count FROM logs GROUP BY yearweek
+            UNION ALL
+            SELECT yearweek, SUM(count) AS count FROM rollups GROUP BY yearweek
+        ) GROUP BY yearweek
     ''')
-    
-    conn.commit()
-    conn.close()
+    for row in cursor:
+        week_counts[divmod(row['yearweek'], 100)] = row['count']
+        total += row['count']
+
+    last_week = max(week_counts) if week_counts else None
+    streak = _streak_ending_at(week_counts, last_week) if last_week else 0
+    return week_counts, total, last_week, streak
+
+def _store_aggregates(cursor, week_counts, total, last_week, streak):
+    cursor.execute('DELETE FROM weekly_counts')
+    cursor.executemany(
+        'INSERT INTO weekly_counts (year, week, count) VALUES (?, ?, ?)',
+        [(year, week, count) for (year, week), count in week_counts.items()]
+    )
+    _set_meta(cursor, 'total_logs', total)
+    if last_week:
+        _set_meta(cursor, 'streak_week', _format_week(*last_week))
+        _set_meta(cursor, 'streak_length', streak)
+    else:
+        cursor.execute("DELETE FROM meta WHERE key IN ('streak_week', 'streak_length')")
+
+def _parse_timestamp(timestamp):
+    # Returns (normalized ISO string, datetime). Timestamps are stored as
+    # naive local time in datetime.isoformat() form, whatever ISO 8601
+    # variant was sent, so equal moments compare equal as text.
+    dt = datetime.fromisoformat(timestamp)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone().replace(tzinfo=None)
+    return dt.isoformat(), dt
 
 def add_log(timestamp=None):
     if timestamp is None:
         timestamp = datetime.now().isoformat()
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO logs (timestamp) VALUES (?)', (timestamp,))
-    conn.commit()
-    conn.close()
+    timestamp, dt = _parse_timestamp(timestamp)
+
+    with metrics.span('db_add_log'), transaction(write=True) as cursor:
+        cursor.execute(
+            'INSERT INTO logs (timestamp, ts, day, yearweek) VALUES (?, ?, ?, ?)',
+            (timestamp,) + _log_columns(dt)
+        )
+        _record_log(cursor, dt)
+        _bump_data_version(cursor)
+
+def add_logs(timestamps, dedupe=False):
+    """Inserts many ISO timestamps in one transaction and returns how many were added.
+
+    Every timestamp is validated before anything is written, so a bad
+    value, or one more than MAX_FUTURE_SKEW ahead of now, raises
+    ValueError and leaves the database untouched. With
+    dedupe, timestamps already logged (or repeated in the batch) are
+    skipped, as are any from days compact_logs() already rolled up:
+    their raw rows are gone, so they cannot be told apart from logs
+    that were counted.
+    """
+    latest = datetime.now() + MAX_FUTURE_SKEW
+    rows = []
+    for i, timestamp in enumerate(timestamps):
+        try:
+            timestamp, dt = _parse_timestamp(timestamp)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid timestamp at index {i}: {timestamp!r}")
+        if dt > latest:
+            raise ValueError(f"Timestamp at index {i} is in the future: {timestamp!r}")
+        rows.append((timestamp,) + _log_columns(dt))
+
+    if not rows:
+        return 0
+
+    with transaction(write=True) as cursor:
+        cursor.execute('SELECT MAX(id) FROM logs')
+        first_id = cursor.fetchone()[0] or 0
+
+        if dedupe:
+            compacted = _get_meta(cursor, 'compacted_before')
+            if compacted is not None:
+                rows = [row for row in rows if row[2] >= compacted]
+            cursor.executemany('''
+                INSERT INTO logs (timestamp, ts, day, yearweek)
+                SELECT ?1, ?2, ?3, ?4
+                WHERE NOT EXISTS (SELECT 1 FROM logs WHERE ts = ?2 AND timestamp = ?1)
+            ''', rows)
+        else:
+            cursor.executemany('INSERT INTO logs (timestamp, ts, day, yearweek) VALUES (?, ?, ?, ?)', rows)
+
+        inserted = _record_logs(cursor, first_id)
+        if inserted:
+            _bump_data_version(cursor)
+    return inserted
 
 def get_all_logs():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT timestamp FROM logs ORDER BY timestamp ASC')
-    rows = cursor.fetchall()
-    conn.close()
+    with transaction() as cursor:
+        cursor.execute('SELECT timestamp FROM logs ORDER BY ts ASC, id ASC')
+        rows = cursor.fetchall()
     return [row['timestamp'] for row in rows]
 
-def get_offset():
+def get_logs_page(since=None, until=None, after=None, limit=None):
+    # Logs in the range ordered by (ts, id), starting after the (ts, id)
+    # keyset 'after' so paging never re-scans earlier rows
+    low, high = _epoch_bounds(since, until)
+    query = 'SELECT id, timestamp, ts FROM logs WHERE ts >= ? AND ts < ?'
+    params = [low, high]
+    if after is not None:
+        query += ' AND (ts > ? OR (ts = ? AND id > ?))'
+        params += [after[0], after[0], after[1]]
+    query += ' ORDER BY ts ASC, id ASC'
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit)
+
+    with transaction() as cursor:
+        cursor.execute(query, params)
+        return cursor.fetchall()
+
+def get_logs_after_id(last_id, limit):
+    # Logs inserted after row last_id, in insertion order (a rowid seek)
+    with transaction() as cursor:
+        cursor.execute(
+            'SELECT id, timestamp, ts, day FROM logs WHERE id > ? ORDER BY id ASC LIMIT ?',
+            (last_id, limit)
+        )
+        return cursor.fetchall()
+
+def get_last_log_id():
+    with transaction() as cursor:
+        cursor.execute('SELECT MAX(id) FROM logs')
+        return cursor.fetchone()[0] or 0
+
+def get_daily_counts(start_day, end_day):
+    # {date: count} for local days in [start_day, end_day), grouped over the
+    # day index. Daily rollups count on their day; weekly ones are left
+    # out, since their logs cannot be placed on a day.
+    bounds = (start_day.isoformat(), end_day.isoformat())
+    with transaction() as cursor:
+        cursor.execute('''
+            SELECT day, SUM(count) AS count FROM (
+                SELECT day, COUNT(*) AS count FROM logs WHERE day >= ? AND day < ? GROUP BY day
+                UNION ALL
+                SELECT day, count FROM rollups WHERE day >= ? AND day < ? AND days = 1
+            ) GROUP BY day
+        ''', bounds + bounds)
+        return {date.fromisoformat(row['day']): row['count'] for row in cursor.fetchall()}
+
+def get_rollups():
+    # [(date, count, days)] of rolled-up logs, oldest first
+    with transaction() as cursor:
+        cursor.execute('SELECT day, count, days FROM rollups ORDER BY day')
+        return [(date.fromisoformat(row['day']), row['count'], row['days']) for row in cursor.fetchall()]
+
+def get_local_times(after_id=0):
+    """Returns (last_id, times) for logs with id > after_id.
+
+    times is an array('q') of local wall-clock times as seconds since
+    1970, i.e. each naive timestamp read as if it were UTC, so day and
+    hour fall out of plain integer division. They are derived from the
+    typed ts column, converted back to local time by SQLite.
+    """
+    with transaction() as cursor:
+        last_id = cursor.execute('SELECT COALESCE(MAX(id), 0) FROM logs').fetchone()[0]
+        cursor.row_factory = None
+        cursor.execute(
+            "SELECT CAST(strftime('%s', ts, 'unixepoch', 'localtime') AS INTEGER) FROM logs WHERE id > ? AND id <= ?",
+            (after_id, last_id)
+        )
+        return last_id, array('q', itertools.chain.from_iterable(cursor))
+
+def count_logs(since=None, until=None):
+    with transaction() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM logs WHERE ts >= ? AND ts < ?', _epoch_bounds(since, until))
+        return cursor.fetchone()[0]
+
+def get_stats(now=None):
+    if now is None:
+        now = datetime.now()
+    current_week = _iso_week(now)
+
+    with transaction() as cursor:
+        cursor.execute('SELECT count FROM weekly_counts WHERE year = ? AND week = ?', current_week)
+        row = cursor.fetchone()
+        volume = row['count'] if row else 0
+
+        total = int(_get_meta(cursor, 'total_logs') or 0)
+        offset = int(_get_meta(cursor, 'offset') or 0)
+        last = _get_meta(cursor, 'streak_week')
+
+        # The streak is still alive if the last active week is this week
+        # or last week. Logs dated after this week (clock changes, older
+        # databases) move streak_week past it, so then count the run
+        # ending here from weekly_counts instead.
+        streak = 0
+        if last is not None:
+            last_week = _parse_week(last)
+            previous_week = _previous_week(*current_week)
+            if last_week in (current_week, previous_week):
+                streak = int(_get_meta(cursor, 'streak_length') or 0)
+            elif last_week > current_week:
+                cursor.execute('SELECT year, week FROM weekly_counts WHERE year * 100 + week <= ?',
+                               (current_week[0] * 100 + current_week[1],))
+                weeks = {(row['year'], row['week']) for row in cursor.fetchall()}
+                streak = _streak_ending_at(weeks, current_week if current_week in weeks else previous_week)
+
+    return {
+        "volume": volume,
+        "streak": streak,
+        "total": total + offset
+    }
+
+def rebuild_aggregates():
+    """Recomputes the aggregates from logs and reports any drift."""
+    with transaction(write=True) as cursor:
+        week_counts, total, last_week, streak = _compute_aggregates(cursor)
+
+        cursor.execute('SELECT year, week, count FROM weekly_counts')
+        stored_counts = {(row['year'], row['week']): row['count'] for row in cursor.fetchall()}
+        stored_last = _get_meta(cursor, 'streak_week')
+
+        mismatches = []
+        if stored_counts != dict(week_counts):
+            changed = {w for w in set(stored_counts) | set(week_counts) if stored_counts.get(w) != week_counts.get(w)}
+            mismatches.append(f"weekly_counts differs in {len(changed)} week(s)")
+        if int(_get_meta(cursor, 'total_logs') or 0) != total:
+            mismatches.append(f"total_logs {_get_meta(cursor, 'total_logs')} != {total}")
+        if stored_last != (_format_week(*last_week) if last_week else None):
+            mismatches.append(f"streak_week {stored_last} != {_format_week(*last_week) if last_week else None}")
+        if int(_get_meta(cursor, 'streak_length') or 0) != streak:
+            mismatches.append(f"streak_length {_get_meta(cursor, 'streak_length')} != {streak}")
+
+        _store_aggregates(cursor, week_counts, total, last_week, streak)
+        if mismatches:
+            _bump_data_version(cursor)
+    return mismatches
+
+def _months_before(day, months):
+    year, month = divmod(day.year * 12 + day.month - 1 - months, 12)
+    return date(year, month + 1, min(day.day, calendar.monthrange(year, month + 1)[1]))
+
+def compact_logs(before, granularity=None):
+    """Rolls logs from local days before `before` into rollups rows.
+
+    granularity is 'day' (one row per day) or 'week' (one row per ISO
+    week, only for weeks that end before `before`). The aggregates are
+    unchanged, since the logs are still counted; only raw listings such
+    as /logs lose them. Works in batches of COMPACT_BATCH_DAYS so the
+    write lock is never held for long. Returns the number of logs removed.
+    """
+    granularity = granularity or ROLLUP_GRANULARITY
+    if granularity not in ('day', 'week'):
+        raise ValueError(f"Unknown rollup granularity {granularity!r}")
+    if granularity == 'week':
+        before -= timedelta(days=before.weekday())
+
+    removed = 0
+    while True:
+        with transaction(write=True) as cursor:
+            cursor.execute('SELECT MIN(day) FROM logs WHERE day < ?', (before.isoformat(),))
+            first = cursor.fetchone()[0]
+            if first is None:
+                break
+            # Start on a Monday so weekly batches cover whole weeks
+            start = date.fromisoformat(first)
+            start -= timedelta(days=start.weekday())
+            bounds = (start.isoformat(), min(start + timedelta(days=COMPACT_BATCH_DAYS), before).isoformat())
+
+            if granularity == 'day':
+                cursor.execute('''
+                    SELECT day, yearweek, COUNT(*) AS count FROM logs
+                    WHERE day >= ? AND day < ? GROUP BY day
+                ''', bounds)
+                rows = [(row['day'], row['yearweek'], row['count'], 1) for row in cursor.fetchall()]
+            else:
+                cursor.execute('''
+                    SELECT yearweek, COUNT(*) AS count FROM logs
+                    WHERE day >= ? AND day < ? GROUP BY yearweek
+                ''', bounds)
+                rows = [(date.fromisocalendar(*divmod(row['yearweek'], 100), 1).isoformat(), row['yearweek'], row['count'], 7)
+                        for row in cursor.fetchall()]
+
+            cursor.executemany('''
+                INSERT INTO rollups (day, yearweek, count, days) VALUES (?, ?, ?, ?)
+                ON CONFLICT (day) DO UPDATE SET count = count + excluded.count, days = MAX(days, excluded.days)
+            ''', rows)
+            cursor.execute('DELETE FROM logs WHERE day >= ? AND day < ?', bounds)
+            removed += cursor.rowcount
+            # add_logs(dedupe=True) skips days before this, whose raw logs are gone
+            if bounds[1] > (_get_meta(cursor, 'compacted_before') or ''):
+                _set_meta(cursor, 'compacted_before', bounds[1])
+            _bump_data_version(cursor)
+    return removed
+
+def vacuum():
+    """Returns free pages to the filesystem. Returns the number of pages freed.
+
+    A database created before auto_vacuum was enabled is converted with
+    one full VACUUM; after that only the free pages are released.
+    """
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT value FROM meta WHERE key = ?', ('offset',))
-    row = cursor.fetchone()
-    conn.close()
-    
-    if row:
-        return int(row['value'])
+    free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+    else:
+        # execute() would only run the first step (one page); executescript runs it to completion
+        conn.executescript('PRAGMA incremental_vacuum')
+    freed = free - conn.execute('PRAGMA freelist_count').fetchone()[0]
+    # The file only shrinks once the WAL is checkpointed into it
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return freed
+
+def run_maintenance(today=None, retention_months=None, granularity=None):
+    """Applies the retention policy, then vacuums. Returns (logs rolled up, pages freed)."""
+    if retention_months is None:
+        retention_months = RETENTION_MONTHS
+    removed = 0
+    if retention_months > 0:
+        removed = compact_logs(_months_before(today or date.today(), retention_months), granularity)
+    return removed, vacuum()
+
+def get_offset():
+    with transaction() as cursor:
+        value = _get_meta(cursor, 'offset')
+
+    if value is not None:
+        return int(value)
     return 0
 
 def set_offset(offset):
+    with transaction(write=True) as cursor:
+        _set_meta(cursor, 'offset', offset)
+        _bump_data_version(cursor)
+
+def get_meta(key):
+    # Free-form settings and bookkeeping that are not part of the stats
+    with transaction() as cursor:
+        return _get_meta(cursor, key)
+
+def set_meta(key, value):
+    with transaction(write=True) as cursor:
+        if value is None:
+            cursor.execute('DELETE FROM meta WHERE key = ?', (key,))
+        else:
+            _set_meta(cursor, key, value)
+
+def get_data_version():
+    """Returns (version, modified epoch) of the data, bumped by every write.
+
+    The stored counter is only re-read when SQLite's per-connection
+    data_version shows that another connection (or process) committed.
+    """
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', ('offset', str(offset)))
-    conn.commit()
-    conn.close()
+    changes = conn.execute('PRAGMA data_version').fetchone()[0]
+    cached = _local.data_version
+    if cached is not None and cached[0] == changes:
+        return cached[1]
+
+    with transaction() as cursor:
+        version = int(_get_meta(cursor, 'data_version') or 0)
+        modified = float(_get_meta(cursor, 'data_modified') or 0)
+    _local.data_version = (changes, (version, modified))
+    return version, modified
+
+def main():
+    parser = argparse.ArgumentParser(description='Habit Tracker Database')
+    parser.add_argument('--rebuild-stats', action='store_true', help='Recompute stats aggregates from logs and verify them')
+    parser.add_argument('--compact', action='store_true', help='Roll up old logs per the retention policy, then vacuum')
+    parser.add_argument('--retention-months', type=int, default=RETENTION_MONTHS,
+                        help='Keep raw logs for this many months (default: HABIT_RETENTION_MONTHS)')
+    parser.add_argument('--granularity', choices=('day', 'week'), default=ROLLUP_GRANULARITY,
+                        help='Rollup size for compacted logs (default: HABIT_ROLLUP)')
+    args = parser.parse_args()
+
+    if args.rebuild_stats:
+        init_db()
+        mismatches = rebuild_aggregates()
+        if mismatches:
+            print("Aggregates were out of date and have been rebuilt:")
+            for mismatch in mismatches:
+                print(f"  {mismatch}")
+        else:
+            print("Aggregates match logs.")
+    elif args.compact:
+        init_db()
+        removed, freed = run_maintenance(retention_months=args.retention_months, granularity=args.granularity)
+        print(f"Rolled up {removed} logs, freed {freed} pages.")
+    else:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
@@ -29,25 +29,65 @@
 
 import logging
 
+from PIL import Image
+
 import epdconfig
+import metrics
 
 # Display resolution
 EPD_WIDTH       = 122
 EPD_HEIGHT      = 250
 
+# Windowed uploads allowed before the whole RAM is rewritten again
+FULL_REFRESH_INTERVAL = 10
+
+# Register setup sent by init() after SWRESET: (command, parameter bytes)
+INIT_SEQUENCE = (
+    (0x01, [0xf9, 0x00, 0x00]),     # Driver output control
+    (0x11, [0x03]),                 # data entry mode
+    (0x44, [0x00, (EPD_WIDTH - 1) >> 3]),   # RAM X start/end (full window)
+    (0x45, [0x00, 0x00, (EPD_HEIGHT - 1) & 0xff, (EPD_HEIGHT - 1) >> 8]),  # RAM Y start/end
+    (0x4E, [0x00]),                 # RAM X counter
+    (0x4F, [0x00, 0x00]),           # RAM Y counter
+    (0x3C, [0x05]),                 # BorderWavefrom
+    (0x18, [0x80]),                 # Read built-in temperature sensor
+    (0x21, [0x80, 0x80]),           # Display update control
+)
+
 logger = logging.getLogger(__name__)
 
 class EPD:
-    def __init__(self):
+    # The red/black/white panel has no partial-refresh waveform: every
+    # update runs the full refresh. Only the RAM upload can be narrowed
+    # to the changed window.
+    supports_partial = False
+
+    def __init__(self, full_refresh_interval=FULL_REFRESH_INTERVAL):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
         self.busy_pin = epdconfig.BUSY_PIN
         self.cs_pin = epdconfig.CS_PIN
         self.width = EPD_WIDTH
         self.height = EPD_HEIGHT
+        # Bytes per panel row and per colour plane
+        self.linewidth = (self.width + 7) // 8
+        self.plane_size = self.linewidth * self.height
+        # Reused output buffers for getbuffer(image, plane)
+        self.planes = (bytearray(self.plane_size), bytearray(self.plane_size))
+        self.white = b'\xff' * self.plane_size
+        # What the controller RAM holds (None when unknown), and upload bookkeeping
+        self.shadow = None
+        self.full_refresh_interval = full_refresh_interval
+        self.uploads_since_full = 0
+        self.windowed = False
+        self.last_upload_bytes = 0
+        # Last level driven on the DC pin (None when unknown)
+        self.dc_level = None
 
     # hardware reset
     def reset(self):
+        self.shadow = None
+        self.windowed = False
         epdconfig.digital_write(self.reset_pin, 1)
         epdconfig.delay_ms(200) 
         epdconfig.digital_write(self.reset_pin, 0)
@@ -55,26 +95,28 @@ class EPD:
         epdconfig.digital_write(self.reset_pin, 1)
         epdconfig.delay_ms(200)   
 
-    # send 1 byte command
-    def send_command(self, command):
-        epdconfig.digital_write(self.dc_pin, 0)
-        epdconfig.digital_write(self.cs_pin, 0)
+    # drive DC only when its level changes; CS is handled by spidev
+    def set_dc(self, level):
+        if self.dc_level != level:
+            epdconfig.digital_write(self.dc_pin, level)
+            self.dc_level = level
+
+    # send 1 byte command, followed by its parameter bytes in one transfer
+    def send_command(self, command, data=None):
+        self.set_dc(0)
         epdconfig.spi_writebyte([command])
-        epdconfig.digital_write(self.cs_pin, 1)
+        if data:
+            self.send_data2(data)
     
     # send 1 byte data
     def send_data(self, data):
-        epdconfig.digital_write(self.dc_pin, 1)
-        epdconfig.digital_write(self.cs_pin, 0)
+        self.set_dc(1)
         epdconfig.spi_writebyte([data])
-        epdconfig.digital_write(self.cs_pin, 1)
         
     # send a lot of data   
     def send_data2(self, data):
-        epdconfig.digital_write(self.dc_pin, 1)
-        epdconfig.digital_write(self.cs_pin, 0)
+        self.set_dc(1)
         epdconfig.spi_writebyte2(data)
-        epdconfig.digital_write(self.cs_pin, 1)
         
     # judge e-Paper whether is busy
     def busy(self):
@@ -85,108 +127,143 @@ class EPD:
 
     # set the display window
     def set_windows(self, xstart, ystart, xend, yend):
-        self.send_command(0x44) # SET_RAM_X_ADDRESS_START_END_POSITION
-        self.send_data((xstart>>3) & 0xff)
-        self.send_data((xend>>3) & 0xff)
-        
-        self.send_command(0x45) # SET_RAM_Y_ADDRESS_START_END_POSITION
-        self.send_data(ystart & 0xff)
-        self.send_data((ystart >> 8) & 0xff)
-        self.send_data(yend & 0xff)
-        self.send_data((yend >> 8) & 0xff)
+        # SET_RAM_X_ADDRESS_START_END_POSITION
+        self.send_command(0x44, [(xstart>>3) & 0xff, (xend>>3) & 0xff])
+        # SET_RAM_Y_ADDRESS_START_END_POSITION
+        self.send_command(0x45, [ystart & 0xff, (ystart >> 8) & 0xff, yend & 0xff, (yend >> 8) & 0xff])
         
     # set the display cursor(origin)
     def set_cursor(self, xstart, ystart):
-        self.send_command(0x4E) # SET_RAM_X_ADDRESS_COUNTER
-        self.send_data(xstart & 0xff)
-
-        self.send_command(0x4F) # SET_RAM_Y_ADDRESS_COUNTER
-        self.send_data(ystart & 0xff)
-        self.send_data((ystart >> 8) & 0xff)
+        self.send_command(0x4E, [xstart & 0xff]) # SET_RAM_X_ADDRESS_COUNTER
+        self.send_command(0x4F, [ystart & 0xff, (ystart >> 8) & 0xff]) # SET_RAM_Y_ADDRESS_COUNTER
 
     # initialize 
     def init(self):
-        if (epdconfig.module_init() != 0):
-            return -1
-            
-        self.reset()
-
-        self.busy()
-        self.send_command(0x12)  # SWRESET
-        self.busy()   
-
-        self.send_command(0x01) # Driver output control      
-        self.send_data(0xf9)
-        self.send_data(0x00)
-        self.send_data(0x00)
-
-        self.send_command(0x11) # data entry mode       
-        self.send_data(0x03)
+        with metrics.span('epd_init'):
+            self.dc_level = None
+            if (epdconfig.module_init() != 0):
+                return -1
+                
+            self.reset()
 
-        self.set_windows(0, 0, self.width - 1, self.height - 1)
-        self.set_cursor(0, 0)
+            self.busy()
+            self.send_command(0x12)  # SWRESET
+            self.busy()   
 
-        self.send_command(0x3C) # BorderWavefrom
-        self.send_data(0x05)	
+            for command, data in INIT_SEQUENCE:
+                self.send_command(command, data)
 
-        self.send_command(0x18) # Read built-in temperature sensor
-        self.send_data(0x80)	
-
-        self.send_command(0x21) # Display update control
-        self.send_data(0x80)	
-        self.send_data(0x80)
-
-        self.busy()
+            self.busy()
         
         return 0
 
     # turn on display
     def ondisplay(self):
-        self.send_command(0x20)
-        self.busy()
+        with metrics.span('epd_refresh'):
+            self.send_command(0x20)
+            self.busy()
+        metrics.inc('panel_refreshes')
 
     # image converted to bytearray
-    def getbuffer(self, image):
+    # plane 0/1 packs into a reused per-plane buffer (valid until the next
+    # call for that plane); plane None returns a new bytearray
+    def getbuffer(self, image, plane=None):
         img = image
         imwidth, imheight = img.size
+        buf = bytearray(self.plane_size) if plane is None else self.planes[plane]
         if(imwidth == self.width and imheight == self.height):
-            img = img.convert('1')
+            buf[:] = img.convert('1').tobytes('raw')
         elif(imwidth == self.height and imheight == self.width):
             # image has correct dimensions, but needs to be rotated
-            img = img.rotate(90, expand=True).convert('1')
+            if img.mode == '1':
+                # a bit-exact transpose, no resampling or conversion copy
+                buf[:] = img.transpose(Image.Transpose.ROTATE_90).tobytes('raw')
+            else:
+                buf[:] = img.rotate(90, expand=True).convert('1').tobytes('raw')
         else:
             logger.warning("Wrong image dimensions: must be " + str(self.width) + "x" + str(self.height))
             # return a blank buffer
             return [0x00] * (int(self.width/8) * self.height)
 
-        buf = bytearray(img.tobytes('raw'))
         return buf
 
+    # bounding window (x in bytes, y in rows, inclusive) of what differs
+    # from the RAM shadow, or None if nothing does
+    def dirty_window(self, imageblack, imagered):
+        lw = self.linewidth
+        x0, y0, x1, y1 = lw, self.height, -1, -1
+        for plane, old in ((imageblack, self.shadow[0]), (imagered, self.shadow[1])):
+            if plane == old:
+                continue
+            for y in range(self.height):
+                start = y * lw
+                if plane[start:start + lw] == old[start:start + lw]:
+                    continue
+                y0, y1 = min(y0, y), max(y1, y)
+                for x in range(lw):
+                    if plane[start + x] != old[start + x]:
+                        x0, x1 = min(x0, x), max(x1, x)
+        if y1 < 0:
+            return None
+        return x0, y0, x1, y1
+
+    # write only a window of both planes into RAM
+    def upload_window(self, imageblack, imagered, window):
+        x0, y0, x1, y1 = window
+        lw = self.linewidth
+        self.set_windows(x0 * 8, y0, x1 * 8 + 7, y1)
+        for command, plane in ((0x24, imageblack), (0x26, imagered)):
+            self.set_cursor(x0, y0)
+            self.send_command(command)
+            self.send_data2(b''.join(plane[y * lw + x0:y * lw + x1 + 1] for y in range(y0, y1 + 1)))
+        self.windowed = True
+        return 2 * (x1 - x0 + 1) * (y1 - y0 + 1)
+
+    # restore the full-panel window after windowed uploads
+    def full_window(self):
+        if self.windowed:
+            self.set_windows(0, 0, self.width - 1, self.height - 1)
+            self.set_cursor(0, 0)
+            self.windowed = False
+
     # display image
     def display(self, imageblack, imagered):
-        self.send_command(0x24)
-        self.send_data2(imageblack)
-        
-        self.send_command(0x26)
-        self.send_data2(imagered)
-        
+        window = None
+        if self.shadow is not None and self.uploads_since_full < self.full_refresh_interval:
+            window = self.dirty_window(imageblack, imagered)
+            if window is None:
+                logger.debug("Frame unchanged, skipping refresh")
+                self.last_upload_bytes = 0
+                return
+
+        with metrics.span('epd_upload'):
+            if window is not None:
+                self.last_upload_bytes = self.upload_window(imageblack, imagered, window)
+                self.uploads_since_full += 1
+            else:
+                self.full_window()
+                self.send_command(0x24)
+                self.send_data2(imageblack)
+
+                self.send_command(0x26)
+                self.send_data2(imagered)
+                self.last_upload_bytes = 2 * self.plane_size
+                self.uploads_since_full = 0
+
+        self.shadow = (bytes(imageblack), bytes(imagered))
         self.ondisplay()
         
     # display white image
     def clear(self):
-        if self.width%8 == 0:
-            linewidth = int(self.width/8)
-        else:
-            linewidth = int(self.width/8) + 1
-            
-        buf = [0xff] * (int(linewidth * self.height))
-            
+        self.full_window()
         self.send_command(0x24)
-        self.send_data2(buf)
+        self.send_data2(self.white)
         
         self.send_command(0x26)
-        self.send_data2(buf)
+        self.send_data2(self.white)
         
+        self.shadow = (self.white, self.white)
+        self.uploads_since_full = 0
         self.ondisplay()
 
     # Compatible with older version functions
@@ -195,10 +272,13 @@ class EPD:
 
     # sleep
     def sleep(self):
-        self.send_command(0x10) # DEEP_SLEEP
-        self.send_data(0x01) # check code
-        
-        epdconfig.delay_ms(2000)
-        epdconfig.module_exit()
+        with metrics.span('epd_sleep'):
+            self.send_command(0x10, [0x01]) # DEEP_SLEEP, check code
+            
+            epdconfig.delay_ms(2000)
+            epdconfig.module_exit()
+        # module_exit cuts panel power, so RAM contents are gone
+        self.shadow = None
+        self.dc_level = None
 ### END OF FILE ###
 
@@ -1,5 +1,4 @@
-import spidev
-import RPi.GPIO as GPIO
+import os
 import time
 import logging
 import sys
@@ -13,35 +12,58 @@ CS_PIN   = 8
 BUSY_PIN = 24
 PWR_PIN  = 18
 
+# SPI clock and the largest single transfer; override with the
+# EPD_SPI_SPEED_HZ / EPD_SPI_CHUNK_SIZE environment variables
+SPI_SPEED_HZ = int(os.environ.get("EPD_SPI_SPEED_HZ", "2000000"))
+SPI_CHUNK_SIZE = int(os.environ.get("EPD_SPI_CHUNK_SIZE", "4096"))
+
+# Hardware backend: 'rpi' drives the real panel and pins, 'sim' emulates
+# them (see Simulator) so everything runs headless
+BACKEND = os.environ.get("EPD_BACKEND", "rpi")
+
 class RaspberryPi:
     def __init__(self):
+        import spidev
+        import RPi.GPIO
+        self.GPIO = RPi.GPIO
         self.SPI = spidev.SpiDev()
         self.RST_PIN = RST_PIN
         self.DC_PIN = DC_PIN
         self.CS_PIN = CS_PIN
         self.BUSY_PIN = BUSY_PIN
         self.PWR_PIN = PWR_PIN
+        # Running totals, handy for spotting chatty code paths
+        self.counters = {'spi_transactions': 0, 'spi_bytes': 0, 'gpio_writes': 0}
 
     def digital_write(self, pin, value):
         if pin == CS_PIN:
             return
-        GPIO.output(pin, value)
+        self.counters['gpio_writes'] += 1
+        self.GPIO.output(pin, value)
 
     def digital_read(self, pin):
-        val = GPIO.input(pin)
+        val = self.GPIO.input(pin)
         return val
 
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
     def spi_writebyte(self, data):
+        self.counters['spi_transactions'] += 1
+        self.counters['spi_bytes'] += len(data)
         self.SPI.writebytes(data)
 
     def spi_writebyte2(self, data):
-        self.SPI.writebytes2(data)
+        data = memoryview(bytes(data) if isinstance(data, list) else data)
+        for start in range(0, len(data), SPI_CHUNK_SIZE):
+            chunk = data[start:start + SPI_CHUNK_SIZE]
+            self.counters['spi_transactions'] += 1
+            self.counters['spi_bytes'] += len(chunk)
+            self.SPI.writebytes2(chunk)
 
     def module_init(self):
         logger.debug("Initializing module with RPi.GPIO")
+        GPIO = self.GPIO
         GPIO.setmode(GPIO.BCM)
         GPIO.setwarnings(False)
         
@@ -56,12 +78,12 @@ class RaspberryPi:
         # We do NOT setup it as GPIO.
         
         GPIO.output(PWR_PIN, 1)
-        time.sleep(0.1)
+        self.delay_ms(100)
         
         try:
             # SPI device, bus = 0, device = 0
             self.SPI.open(0, 0)
-            self.SPI.max_speed_hz = 2000000
+            self.SPI.max_speed_hz = SPI_SPEED_HZ
             self.SPI.mode = 0b00
         except Exception as e:
             logger.error(f"SPI Open Failed: {e}")
@@ -73,13 +95,188 @@ class RaspberryPi:
         logger.debug("spi end")
         self.SPI.close()
         
-        GPIO.output(RST_PIN, 0)
-        GPIO.output(DC_PIN, 0)
-        GPIO.output(PWR_PIN, 0)
+        self.GPIO.output(RST_PIN, 0)
+        self.GPIO.output(DC_PIN, 0)
+        self.GPIO.output(PWR_PIN, 0)
         # GPIO.cleanup() # Do not cleanup, it kills the button/LED pins!
 
+class SimGPIO:
+    """Stand-in for the RPi.GPIO module, with a press() for fake buttons."""
+    BCM = 11
+    IN, OUT = 1, 0
+    LOW, HIGH = 0, 1
+    PUD_DOWN, PUD_UP = 21, 22
+    RISING, FALLING, BOTH = 31, 32, 33
+
+    def __init__(self):
+        self.levels = {}
+        self.callbacks = {}
+        self.writes = 0
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=None, initial=None):
+        if direction == self.IN:
+            self.levels[pin] = self.HIGH if pull_up_down == self.PUD_UP else self.LOW
+        elif initial is not None:
+            self.levels[pin] = initial
+
+    def output(self, pin, value):
+        self.writes += 1
+        self.levels[pin] = int(bool(value))
+
+    def input(self, pin):
+        return self.levels.get(pin, self.LOW)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self.callbacks[pin] = (edge, callback)
+
+    def remove_event_detect(self, pin):
+        self.callbacks.pop(pin, None)
+
+    def cleanup(self):
+        self.callbacks.clear()
+
+    def set_input(self, pin, level):
+        """Drives an input pin, firing edge callbacks like the real module."""
+        old = self.levels.get(pin, self.LOW)
+        self.levels[pin] = level
+        edge, callback = self.callbacks.get(pin, (None, None))
+        if callback is None or old == level:
+            return
+        if edge == self.BOTH or edge == (self.FALLING if level == self.LOW else self.RISING):
+            callback(pin)
+
+    def press(self, pin, duration=0.1):
+        """Presses an active-low button wired to pin."""
+        self.set_input(pin, self.LOW)
+        time.sleep(duration)
+        self.set_input(pin, self.HIGH)
+
+class SimPanel:
+    """Stand-in for spidev that emulates the panel controller.
+
+    Commands and data are decoded using the DC level on gpio, so RAM
+    windows, cursors and both colour planes behave as on the device.
+    Every master activation (0x20) counts as a refresh and, when
+    frame_dir is set, the panel contents are saved there as a PNG.
+    """
+    def __init__(self, gpio, width=122, height=250, frame_dir=None):
+        self.gpio = gpio
+        self.linewidth = (width + 7) // 8
+        self.width = width
+        self.height = height
+        self.frame_dir = frame_dir
+        self.max_speed_hz = 0
+        self.mode = 0
+        self.ram = {0x24: bytearray(b'\xff' * self.linewidth * height),
+                    0x26: bytearray(b'\xff' * self.linewidth * height)}
+        self.refreshes = 0
+        self.command = None
+        self.params = []
+        self.window = (0, self.linewidth - 1, 0, height - 1)
+        self.cursor = (0, 0)
+
+    def open(self, bus, device):
+        pass
+
+    def close(self):
+        self.finish()
+
+    def writebytes(self, data):
+        self.receive(data)
+
+    def writebytes2(self, data):
+        self.receive(data)
+
+    def receive(self, data):
+        if self.gpio.input(DC_PIN) == 0:
+            for command in data:
+                self.finish()
+                self.command = command
+                if command == 0x20:
+                    self.refresh()
+            return
+        ram = self.ram.get(self.command)
+        if ram is None:
+            self.params.extend(data)
+            return
+        x, y = self.cursor
+        x0, x1, y0, y1 = self.window
+        lw = self.linewidth
+        for byte in data:
+            if 0 <= y < self.height and 0 <= x < lw:
+                ram[y * lw + x] = byte
+            x += 1
+            if x > x1:
+                x, y = x0, y + 1
+                if y > y1:
+                    y = y0
+        self.cursor = (x, y)
+
+    def finish(self):
+        # Apply the parameters collected for the current command
+        p = self.params
+        if self.command == 0x44 and len(p) >= 2:
+            self.window = (p[0], p[1]) + self.window[2:]
+        elif self.command == 0x45 and len(p) >= 4:
+            self.window = self.window[:2] + (p[0] | p[1] << 8, p[2] | p[3] << 8)
+        elif self.command == 0x4E and p:
+            self.cursor = (p[0], self.cursor[1])
+        elif self.command == 0x4F and len(p) >= 2:
+            self.cursor = (self.cursor[0], p[0] | p[1] << 8)
+        self.command = None
+        self.params = []
+
+    def image(self):
+        """The panel contents as a landscape RGB image."""
+        from PIL import Image
+        size = (self.linewidth * 8, self.height)
+        black = Image.frombytes('1', size, bytes(self.ram[0x24]))
+        red = Image.frombytes('1', size, bytes(self.ram[0x26]))
+        image = Image.new('RGB', size, (255, 255, 255))
+        image.paste((0, 0, 0), mask=black.point(lambda v: 255 - v))
+        image.paste((255, 0, 0), mask=red.point(lambda v: 255 - v))
+        return image.crop((0, 0, self.width, self.height)).transpose(Image.Transpose.ROTATE_270)
+
+    def refresh(self):
+        self.refreshes += 1
+        if self.frame_dir:
+            os.makedirs(self.frame_dir, exist_ok=True)
+            self.image().save(os.path.join(self.frame_dir, f"frame_{self.refreshes:05d}.png"))
+
+class Simulator(RaspberryPi):
+    """Headless backend: RaspberryPi logic over SimGPIO and SimPanel.
+
+    EPD_SIM_FRAMES names a directory for PNGs of each refresh, and
+    EPD_SIM_REALTIME=1 makes delay_ms really sleep.
+    """
+    def __init__(self):
+        self.GPIO = SimGPIO()
+        self.SPI = SimPanel(self.GPIO, frame_dir=os.environ.get("EPD_SIM_FRAMES"))
+        self.RST_PIN = RST_PIN
+        self.DC_PIN = DC_PIN
+        self.CS_PIN = CS_PIN
+        self.BUSY_PIN = BUSY_PIN
+        self.PWR_PIN = PWR_PIN
+        self.realtime = os.environ.get("EPD_SIM_REALTIME") == "1"
+        self.counters = {'spi_transactions': 0, 'spi_bytes': 0, 'gpio_writes': 0, 'delay_ms': 0}
+
+    def delay_ms(self, delaytime):
+        self.counters['delay_ms'] += delaytime
+        if self.realtime:
+            time.sleep(delaytime / 1000.0)
+
+BACKENDS = {'rpi': RaspberryPi, 'sim': Simulator}
+if BACKEND not in BACKENDS:
+    raise ValueError(f"Unknown EPD_BACKEND {BACKEND!r}, expected one of {', '.join(BACKENDS)}")
+
 # Expose methods to module level
-implementation = RaspberryPi()
+implementation = BACKENDS[BACKEND]()
 for func in [x for x in dir(implementation) if not x.startswith('_')]:
     setattr(sys.modules[__name__], func, getattr(implementation, func))
 
@@ -0,0 +1,116 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds, in seconds (panel refreshes take ~15 s)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30)
+
+# Where the device process publishes its metrics for the API to serve
+METRICS_FILE = os.environ.get(
+    'HABIT_METRICS_FILE',
+    os.path.join(os.path.dirname(os.path.realpath(__file__)), '.metrics.json'))
+
+_lock = threading.Lock()
+# (name, ((label, value), ...)) -> [bucket counts..., sum, count, max]
+_histograms = {}
+# (name, ((label, value), ...)) -> value
+_counters = {}
+# Callables returning {name: value}, sampled into counters on snapshot()
+_collectors = []
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def observe(name, seconds, **labels):
+    """Records one duration in the histogram name."""
+    key = _key(name, labels)
+    index = bisect.bisect_left(BUCKETS, seconds)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0, 0, 0.0]
+        hist[index] += 1
+        hist[-3] += seconds
+        hist[-2] += 1
+        if seconds > hist[-1]:
+            hist[-1] = seconds
+
+def inc(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+@contextmanager
+def span(name, **labels):
+    """Times the enclosed block into the histogram name."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+def register_collector(collect):
+    """Adds a callable whose {name: value} dict is reported as counters."""
+    _collectors.append(collect)
+
+def snapshot():
+    """Returns all metrics as plain data (JSON serialisable)."""
+    with _lock:
+        histograms = [[name, dict(labels), list(hist)] for (name, labels), hist in _histograms.items()]
+        counters = [[name, dict(labels), value] for (name, labels), value in _counters.items()]
+    for collect in _collectors:
+        counters.extend([name, {}, value] for name, value in collect().items())
+    return {'created': time.time(), 'histograms': histograms, 'counters': counters}
+
+def save(path=METRICS_FILE):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(snapshot(), f)
+    os.replace(tmp, path)
+
+def load(path=METRICS_FILE):
+    """Returns a snapshot saved by another process, or None."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in sorted(labels.items())) + '}'
+
+def render_prometheus(snapshots):
+    """Renders (extra_labels, snapshot) pairs in the Prometheus text format."""
+    # Samples of one metric family must be contiguous, so group across snapshots
+    families = {}
+    for extra, snap in snapshots:
+        for name, labels, hist in snap['histograms']:
+            name = f"habit_{name}_seconds"
+            lines = families.setdefault(name, [f"# TYPE {name} histogram"])
+            labels = {**extra, **labels}
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), hist):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels({**labels, 'le': bound})} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {hist[-3]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {hist[-2]}")
+        for name, labels, value in snap['counters']:
+            name = f"habit_{name}_total"
+            lines = families.setdefault(name, [f"# TYPE {name} counter"])
+            lines.append(f"{name}{_format_labels({**extra, **labels})} {value}")
+    return ''.join(line + '\n' for lines in families.values() for line in lines)
+
+def summary(snap):
+    """One log line: count, mean and max per histogram, then counters."""
+    parts = []
+    for name, labels, hist in sorted(snap['histograms'], key=lambda h: h[0]):
+        label = name + _format_labels(labels)
+        parts.append(f"{label} n={hist[-2]} avg={hist[-3] / hist[-2] * 1000:.1f}ms max={hist[-1] * 1000:.1f}ms")
+    for name, labels, value in sorted(snap['counters'], key=lambda c: c[0]):
+        parts.append(f"{name}{_format_labels(labels)}={value}")
+    return '; '.join(parts)
@@ -1,58 +1,185 @@
 import json
 import os
+import argparse
 import database
 
 STATS_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "stats.json")
 
-def migrate():
-    if not os.path.exists(STATS_FILE):
+# Logs committed per transaction, and bytes read from stats.json at a time
+BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+
+# meta key recording how far an interrupted import got
+CHECKPOINT_KEY = 'import_checkpoint'
+
+_decoder = json.JSONDecoder()
+
+class StatsReader:
+    """Incremental reader for stats.json.
+
+    Only the current chunk of the file and the value being decoded are
+    held in memory, so the size of the history list does not matter.
+    """
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _read(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        # Next non-whitespace character, without consuming it
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._read():
+                raise ValueError("Unexpected end of stats.json")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at offset {self.pos} of the current chunk")
+        self.pos += 1
+
+    def value(self):
+        # Decode one JSON value. A value ending exactly at the end of the
+        # buffer may be truncated (e.g. a number), so read on until
+        # something follows it.
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._read()
+
+    def items(self):
+        """Yields ('history', timestamp) per history entry and (key, value) for other keys."""
+        self.expect('{')
+        if self.peek() == '}':
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            if key == 'history' and self.peek() == '[':
+                self.expect('[')
+                if self.peek() == ']':
+                    self.pos += 1
+                else:
+                    while True:
+                        yield 'history', self.value()
+                        if self.peek() == ']':
+                            self.pos += 1
+                            break
+                        self.expect(',')
+                # Lets callers tell an empty history from a missing one
+                yield 'history_end', None
+            else:
+                yield key, self.value()
+
+            if self.peek() == '}':
+                return
+            self.expect(',')
+
+def file_signature(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+def load_checkpoint(signature):
+    # Number of history entries already committed from this exact file
+    value = database.get_meta(CHECKPOINT_KEY)
+    if value is None:
+        return 0
+    checkpoint = json.loads(value)
+    if checkpoint.get('file') != signature:
+        return 0
+    return checkpoint['index']
+
+def commit_batch(batch, index, signature):
+    # Logs and checkpoint are written together, so a crash never loses or repeats a batch
+    with database.transaction(write=True):
+        inserted = database.add_logs(batch, dedupe=True)
+        database.set_meta(CHECKPOINT_KEY, json.dumps({"file": signature, "index": index}))
+    return inserted
+
+def migrate(path=STATS_FILE, batch_size=BATCH_SIZE):
+    # Create the database or bring its schema up to date
+    database.init_db()
+
+    if not os.path.exists(path):
         print("No stats.json found. Skipping migration.")
         return
 
-    print("Found stats.json. initializing database...")
-    database.init_db()
+    print("Found stats.json. Migrating...")
 
     try:
-        with open(STATS_FILE, 'r') as f:
-            data = json.load(f)
-        
-        history = data.get('history', [])
-        offset = data.get('offset', 0)
-        
+        signature = file_signature(path)
+        checkpoint = load_checkpoint(signature)
+        if checkpoint:
+            print(f"Resuming after {checkpoint} previously imported logs...")
+
+        offset = 0
+        count = None
+        has_history = False
+        index = 0
+        inserted = 0
+        batch = []
+
+        with open(path, 'r') as f:
+            for key, value in StatsReader(f).items():
+                if key == 'history':
+                    index += 1
+                    if index <= checkpoint:
+                        continue
+                    batch.append(value)
+                    if len(batch) >= batch_size:
+                        inserted += commit_batch(batch, index, signature)
+                        batch = []
+                elif key == 'history_end':
+                    has_history = True
+                elif key == 'offset':
+                    offset = value
+                elif key == 'count':
+                    count = value
+
         # Handle old format if present
-        if 'count' in data and 'history' not in data:
-            offset = data['count']
-            history = []
-
-        print(f"Migrating {len(history)} logs and offset {offset}...")
-        
-        # Migrate Offset
-        database.set_offset(offset)
-        
-        # Migrate History
-        conn = database.get_db_connection()
-        cursor = conn.cursor()
-        
-        # Check if data already exists to avoid duplicates if run multiple times
-        cursor.execute('SELECT COUNT(*) FROM logs')
-        count = cursor.fetchone()[0]
-        
-        if count == 0:
-            for timestamp in history:
-                cursor.execute('INSERT INTO logs (timestamp) VALUES (?)', (timestamp,))
-            conn.commit()
-            print("Migration complete.")
-        else:
-            print("Database not empty. Skipping history migration to avoid duplicates.")
-            
-        conn.close()
-        
+        if count is not None and not has_history:
+            offset = count
+
+        # Last partial batch, offset and checkpoint removal in one transaction
+        with database.transaction(write=True):
+            inserted += database.add_logs(batch, dedupe=True)
+            database.set_offset(offset)
+            database.set_meta(CHECKPOINT_KEY, None)
+
+        skipped = index - checkpoint - inserted
+        print(f"Migration complete: {inserted} logs added, {skipped} duplicates skipped, offset {offset}.")
+
         # Rename stats.json to stats.json.bak
-        os.rename(STATS_FILE, STATS_FILE + ".bak")
+        os.rename(path, path + ".bak")
         print("Renamed stats.json to stats.json.bak")
 
     except Exception as e:
         print(f"Migration failed: {e}")
+        print("Run migrate.py again to resume.")
 
 if __name__ == "__main__":
-    migrate()
+    parser = argparse.ArgumentParser(description='Import a legacy stats.json into habit.db')
+    parser.add_argument('--file', default=STATS_FILE, help='Path to stats.json')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Logs committed per transaction')
+    args = parser.parse_args()
+    migrate(args.file, args.batch_size)
@@ -0,0 +1,85 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class Handle:
+    """A scheduled call; cancel() stops it from running."""
+    __slots__ = ('when', 'func', 'args', 'cancelled')
+
+    def __init__(self, when, func, args):
+        self.when = when
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class Scheduler:
+    """Runs timed calls one after another on a single thread.
+
+    Calls are kept in a heap ordered by due time (time.monotonic()), with
+    ties run in scheduling order. Scheduled functions must not block:
+    anything slow, such as a panel refresh, should be handed to its own
+    worker.
+    """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.queue = []
+        self.counter = itertools.count()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+        self.thread.start()
+
+    def call_at(self, when, func, *args):
+        handle = Handle(when, func, args)
+        with self.cond:
+            heapq.heappush(self.queue, (when, next(self.counter), handle))
+            self.cond.notify()
+        return handle
+
+    def call_later(self, delay, func, *args):
+        return self.call_at(time.monotonic() + delay, func, *args)
+
+    def call_soon(self, func, *args):
+        return self.call_at(time.monotonic(), func, *args)
+
+    def stop(self):
+        """Drops pending calls and waits for the thread to finish."""
+        with self.cond:
+            self.running = False
+            self.queue.clear()
+            self.cond.notify()
+        if threading.current_thread() is not self.thread:
+            self.thread.join()
+
+    def _next(self):
+        # Pops the next due call, or returns None once stopped
+        with self.cond:
+            while self.running:
+                while self.queue and self.queue[0][2].cancelled:
+                    heapq.heappop(self.queue)
+                if not self.queue:
+                    self.cond.wait()
+                    continue
+                delay = self.queue[0][0] - time.monotonic()
+                if delay <= 0:
+                    return heapq.heappop(self.queue)[2]
+                self.cond.wait(delay)
+            return None
+
+    def _run(self):
+        while True:
+            handle = self._next()
+            if handle is None:
+                return
+            if handle.cancelled:
+                continue
+            try:
+                handle.func(*handle.args)
+            except Exception as e:
+                logger.error(f"Scheduled call {handle.func!r} failed: {e}", exc_info=True)
@@ -1,39 +1,77 @@
+// Counts per YYYY-MM-DD for the heatmap currently drawn
+let dailyCounts = {};
+
 // Fetch Data
 async function fetchData() {
     try {
-        const [logsRes, statsRes] = await Promise.all([
-            fetch('/logs'),
+        const year = new Date().getFullYear();
+        const [heatmapRes, statsRes] = await Promise.all([
+            fetch(`/heatmap?year=${year}`),
             fetch('/stats')
         ]);
 
-        const logs = await logsRes.json();
+        const heatmap = await heatmapRes.json();
         const stats = await statsRes.json();
 
-        renderDashboard(logs, stats);
+        renderDashboard(heatmap, stats);
     } catch (e) {
         console.error("Fetch failed", e);
     }
 }
 
-function renderDashboard(logs, stats) {
+function renderDashboard(heatmap, stats) {
     // 1. Update Header Date
     const options = { weekday: 'long', year: 'numeric', month: 'long', day: 'numeric' };
     document.getElementById('current-date').innerText = new Date().toLocaleDateString('en-US', options);
 
-    // 2. Process Logs into Daily Counts
-    const dailyCounts = {};
-    logs.forEach(ts => {
-        const date = ts.split('T')[0]; // YYYY-MM-DD
-        dailyCounts[date] = (dailyCounts[date] || 0) + 1;
+    // 2. Map Daily Counts by date (counts[i] is start + i days)
+    dailyCounts = {};
+    const [y, m, d] = heatmap.start.split('-').map(Number);
+    heatmap.counts.forEach((count, i) => {
+        if (count > 0) {
+            dailyCounts[formatDate(new Date(y, m - 1, d + i))] = count;
+        }
     });
 
     // 3. Update Cards
+    renderCards(stats);
+
+    // 4. Render Heatmap
+    renderHeatmap(dailyCounts);
+}
+
+function renderCards(stats) {
     document.getElementById('week-count').innerText = stats.volume || 0;
     document.getElementById('streak-count').innerText = stats.streak || 0;
     document.getElementById('total-count').innerText = stats.total || 0;
+}
 
-    // 4. Render Heatmap
-    renderHeatmap(dailyCounts);
+// Patch the cards and heatmap cells in place from a pushed update
+function applyUpdate(update) {
+    if (update.reload) {
+        fetchData();
+        return;
+    }
+
+    update.logs.forEach(log => {
+        const count = (dailyCounts[log.day] || 0) + 1;
+        dailyCounts[log.day] = count;
+
+        const cell = document.querySelector(`.day-cell[data-date="${log.day}"]`);
+        if (cell) {
+            cell.setAttribute('data-level', 1);
+            cell.title = `${log.day}: ${count} logs`;
+        }
+    });
+
+    renderCards(update.stats);
+}
+
+// Format a Date as local YYYY-MM-DD
+function formatDate(date) {
+    const m = String(date.getMonth() + 1).padStart(2, '0');
+    const d = String(date.getDate()).padStart(2, '0');
+    return `${date.getFullYear()}-${m}-${d}`;
 }
 
 function renderHeatmap(dailyCounts) {
@@ -90,6 +128,7 @@ function renderHeatmap(dailyCounts) {
             if (count > 0) level = 1;
 
             cell.setAttribute('data-level', level);
+            cell.setAttribute('data-date', dateStr);
             cell.title = `${dateStr}: ${count} logs`;
 
             monthGrid.appendChild(cell);
@@ -100,7 +139,36 @@ function renderHeatmap(dailyCounts) {
     }
 }
 
+// Listen for pushed updates instead of polling
+function listenForUpdates() {
+    const source = new EventSource('/events');
+    let missedUpdates = false;
+
+    source.onmessage = (event) => applyUpdate(JSON.parse(event.data));
+    source.onerror = () => {
+        // The browser reconnects on its own; resync once it does
+        missedUpdates = true;
+    };
+    source.onopen = () => {
+        if (missedUpdates) {
+            missedUpdates = false;
+            fetchData();
+        }
+    };
+}
+
+// Redraw at midnight so the date, week and year roll over
+function scheduleMidnightRefresh() {
+    const now = new Date();
+    const midnight = new Date(now.getFullYear(), now.getMonth(), now.getDate() + 1);
+    setTimeout(() => {
+        fetchData();
+        scheduleMidnightRefresh();
+    }, midnight - now);
+}
+
 // Init
 fetchData();
-setInterval(fetchData, 60000); // Refresh every minute
+listenForUpdates();
+scheduleMidnightRefresh();
 
@@ -0,0 +1,63 @@
+# Reference weekly metrics over a list of ISO timestamps. Pure Python
+# with no display or hardware imports, so any process can use it; the
+# database keeps the same numbers as running aggregates.
+from datetime import datetime, timedelta
+
+def get_weekly_volume(history):
+    now = datetime.now()
+    current_year, current_week, _ = now.isocalendar()
+    
+    count = 0
+    for ts in history:
+        dt = datetime.fromisoformat(ts)
+        year, week, _ = dt.isocalendar()
+        if year == current_year and week == current_week:
+            count += 1
+    return count
+
+def get_weekly_streak(history):
+    if not history:
+        return 0
+        
+    # Get set of (year, week) for all entries
+    weeks = set()
+    for ts in history:
+        dt = datetime.fromisoformat(ts)
+        weeks.add(dt.isocalendar()[:2])
+    
+    if not weeks:
+        return 0
+
+    now = datetime.now()
+    current_year, current_week, _ = now.isocalendar()
+    
+    streak = 0
+    # Check backwards from current week
+    # If current week has activity, streak starts at 1. 
+    # If not, check previous week (maybe they haven't done it yet this week, but streak is still alive? 
+    # Usually streak implies contiguous blocks. Let's be strict: if you miss a week, streak resets.
+    # But for "current streak", if I did it last week and today is Monday, my streak is still alive.
+    
+    # Let's check if current week is present
+    check_year, check_week = current_year, current_week
+    
+    # If current week is empty, check if last week was active to decide if streak is 0 or just pending
+    if (check_year, check_week) not in weeks:
+        # Move back one week
+        d = datetime.now() - timedelta(days=7)
+        check_year, check_week = d.isocalendar()[:2]
+        if (check_year, check_week) not in weeks:
+            return 0 # No activity this week or last week
+            
+    # Now count backwards
+    while (check_year, check_week) in weeks:
+        streak += 1
+        # Move back one week
+        # Simple way: create a date in that week and subtract 7 days
+        # ISO weeks are tricky to iterate mathematically without date objects
+        # Let's find a date in the current check_week
+        d = datetime.fromisocalendar(check_year, check_week, 1) # Monday of that week
+        d = d - timedelta(days=7)
+        check_year, check_week = d.isocalendar()[:2]
+        
+    return streak
@@ -7,102 +7,94 @@ import logging
 import json
 import argparse
 import random
-from datetime import datetime, timedelta
+import hashlib
+import threading
+from functools import lru_cache
 from PIL import Image, ImageDraw, ImageFont
 
 import database
+import metrics
 
 # Add current directory to path
 libdir = os.path.dirname(os.path.realpath(__file__))
 if os.path.exists(libdir):
     sys.path.append(libdir)
 
-import epd2in13b_V4
-
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 FONT_PATH = '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf'
 
-def get_font(size):
+# Packed buffers of static screens are kept here across restarts (None
+# keeps them in memory only). Bump LAYOUT_VERSION when a static screen's
+# layout changes so stale frames are not reused.
+FRAME_CACHE_DIR = os.path.join(libdir, '.frames')
+LAYOUT_VERSION = 1
+
+# Hash of the frame physically on the panel, kept across restarts
+PANEL_STATE_FILE = os.path.join(libdir, '.panel_state')
+
+# Seconds the panel stays initialised after its last refresh before it
+# is put into deep sleep (0 sleeps straight away)
+PANEL_IDLE_TIMEOUT = float(os.environ.get('PANEL_IDLE_TIMEOUT', '30'))
+
+# Fonts and text metrics are cached for the life of the process, so
+# after the first render no screen touches the font file again.
+@lru_cache(maxsize=None)
+def get_font(size, path=FONT_PATH):
     try:
-        return ImageFont.truetype(FONT_PATH, size)
+        return ImageFont.truetype(path, size)
     except IOError:
         return ImageFont.load_default()
 
-def fit_text(draw, text, max_width, max_height):
-    size = 10
-    font = get_font(size)
-    while True:
-        bbox = draw.textbbox((0, 0), text, font=font)
-        width = bbox[2] - bbox[0]
-        height = bbox[3] - bbox[1]
-        if width >= max_width or height >= max_height:
-            return get_font(size - 1)
-        size += 1
-        font = get_font(size)
-
-def get_weekly_volume(history):
-    now = datetime.now()
-    current_year, current_week, _ = now.isocalendar()
-    
-    count = 0
-    for ts in history:
-        dt = datetime.fromisoformat(ts)
-        year, week, _ = dt.isocalendar()
-        if year == current_year and week == current_week:
-            count += 1
-    return count
-
-def get_weekly_streak(history):
-    if not history:
-        return 0
-        
-    # Get set of (year, week) for all entries
-    weeks = set()
-    for ts in history:
-        dt = datetime.fromisoformat(ts)
-        weeks.add(dt.isocalendar()[:2])
-    
-    if not weeks:
-        return 0
+@lru_cache(maxsize=1024)
+def text_bbox(text, size, path=FONT_PATH, mode='1'):
+    # Same box as draw.textbbox((0, 0), ...) on a 1-bit image; mode=''
+    # gives font.getbbox(text), which the stats screen is laid out with
+    return get_font(size, path).getbbox(text, mode=mode)
 
-    now = datetime.now()
-    current_year, current_week, _ = now.isocalendar()
-    
-    streak = 0
-    # Check backwards from current week
-    # If current week has activity, streak starts at 1. 
-    # If not, check previous week (maybe they haven't done it yet this week, but streak is still alive? 
-    # Usually streak implies contiguous blocks. Let's be strict: if you miss a week, streak resets.
-    # But for "current streak", if I did it last week and today is Monday, my streak is still alive.
-    
-    # Let's check if current week is present
-    check_year, check_week = current_year, current_week
-    
-    # If current week is empty, check if last week was active to decide if streak is 0 or just pending
-    if (check_year, check_week) not in weeks:
-        # Move back one week
-        d = datetime.now() - timedelta(days=7)
-        check_year, check_week = d.isocalendar()[:2]
-        if (check_year, check_week) not in weeks:
-            return 0 # No activity this week or last week
-            
-    # Now count backwards
-    while (check_year, check_week) in weeks:
-        streak += 1
-        # Move back one week
-        # Simple way: create a date in that week and subtract 7 days
-        # ISO weeks are tricky to iterate mathematically without date objects
-        # Let's find a date in the current check_week
-        d = datetime.fromisocalendar(check_year, check_week, 1) # Monday of that week
-        d = d - timedelta(days=7)
-        check_year, check_week = d.isocalendar()[:2]
-        
-    return streak
+@lru_cache(maxsize=1024)
+def text_length(text, size, path=FONT_PATH):
+    return get_font(size, path).getlength(text, mode='1')
 
-def draw_stats(epd):
-    logger.info("Drawing Update State")
+@lru_cache(maxsize=64)
+def fit_size(text, max_width, max_height, path=FONT_PATH):
+    # Largest size below the first one (from 10 up) whose box reaches
+    # either limit, found by bisection instead of stepping one point at a time
+    def too_big(size):
+        bbox = text_bbox(text, size, path)
+        return bbox[2] - bbox[0] >= max_width or bbox[3] - bbox[1] >= max_height
+
+    low, high = 10, 20
+    while not too_big(high):
+        low, high = high, high * 2
+    if too_big(low):
+        return low - 1
+    while high - low > 1:
+        mid = (low + high) // 2
+        if too_big(mid):
+            high = mid
+        else:
+            low = mid
+    return low
+
+_driver = None
+
+def panel_driver():
+    """Imports the e-paper driver, and with it the GPIO/SPI backend, on first use.
+
+    Rendering only needs an object with the panel's width and height, so
+    importing this module never touches the hardware libraries.
+    """
+    global _driver
+    if _driver is None:
+        import epd2in13b_V4
+        # SPI and GPIO traffic of the panel driver, reported with the other metrics
+        metrics.register_collector(lambda: epd2in13b_V4.epdconfig.counters)
+        _driver = epd2in13b_V4
+    return _driver
+
+def render_stats(epd):
     width = epd.height
     height = epd.width
     
@@ -113,13 +105,11 @@ def draw_stats(epd):
     draw_black = ImageDraw.Draw(image_black)
     draw_red = ImageDraw.Draw(image_red)
     
-    # Calculate Metrics from Database
-    history = database.get_all_logs()
-    offset = database.get_offset()
-    
-    vol = get_weekly_volume(history)
-    streak = get_weekly_streak(history)
-    total = len(history) + offset
+    # Read Metrics from the Database aggregates
+    stats = database.get_stats()
+    vol = stats["volume"]
+    streak = stats["streak"]
+    total = stats["total"]
     
     # Layout Constants
     padding = 10
@@ -166,7 +156,7 @@ def draw_stats(epd):
     font_msg = get_font(28)
     
     # Center message
-    bbox = font_msg.getbbox(msg)
+    bbox = text_bbox(msg, 28, mode='')
     msg_w = bbox[2] - bbox[0]
     msg_h = bbox[3] - bbox[1]
     msg_x = (width - msg_w) // 2
@@ -193,24 +183,23 @@ def draw_stats(epd):
         box_center_x = x_start + (box_width // 2)
         
         # Draw Label (Top of box)
-        bbox_l = font_label.getbbox(label)
+        bbox_l = text_bbox(label, 12, mode='')
         l_w = bbox_l[2] - bbox_l[0]
         l_x = box_center_x - (l_w // 2)
         label_y = box_y_start + inner_padding
         draw_black.text((l_x, label_y), label, font=font_label, fill=0)
         
         # Draw Value (Bottom of box)
-        bbox_v = font_value.getbbox(value)
+        bbox_v = text_bbox(value, 24, mode='')
         v_w = bbox_v[2] - bbox_v[0]
         v_x = box_center_x - (v_w // 2)
         # Position value below label + gap
         value_y = label_y + label_h + inner_gap
         draw_black.text((v_x, value_y), value, font=font_value, fill=0)
     
-    epd.display(epd.getbuffer(image_black), epd.getbuffer(image_red))
+    return image_black, image_red
 
-def draw_wyao(epd):
-    logger.info("Drawing Init State (WYAO)")
+def render_wyao(epd):
     width = epd.height
     height = epd.width
     
@@ -227,13 +216,14 @@ def draw_wyao(epd):
     available_height = height - (2 * padding)
     
     # 1. Find the right font size
-    font = fit_text(draw_black, text, available_width, available_height)
+    size = fit_size(text, available_width, available_height)
+    font = get_font(size)
     
     # 2. Calculate total width to center
     total_width = 0
     char_widths = []
     for char in text:
-        l = draw_black.textlength(char, font=font)
+        l = text_length(char, size)
         char_widths.append(l)
         total_width += l
         
@@ -252,10 +242,9 @@ def draw_wyao(epd):
         
         current_x += char_widths[i]
         
-    epd.display(epd.getbuffer(image_black), epd.getbuffer(image_red))
+    return image_black, image_red
 
-def draw_done_screen(epd):
-    logger.info("Drawing Done Screen")
+def render_done_screen(epd):
     width = epd.height
     height = epd.width
     
@@ -279,43 +268,189 @@ def draw_done_screen(epd):
     # But let's try pure 'mm' first as it's standard.
     draw_black.text((x, y), text, font=font, fill=1, anchor="mm")
     
-    epd.display(epd.getbuffer(image_black), epd.getbuffer(image_red))
+    return image_black, image_red
+
+# Screens whose content never changes, rendered once and cached as frames
+STATIC_SCREENS = {
+    'wyao': render_wyao,
+    'done': render_done_screen,
+}
+
+_frames = {}
+
+def frame_key(epd, name):
+    # Identifies a rendered frame: screen, layout, panel size and font version
+    try:
+        font_version = f"{os.path.basename(FONT_PATH)}-{os.stat(FONT_PATH).st_mtime_ns}"
+    except OSError:
+        font_version = "default"
+    return f"{name}-v{LAYOUT_VERSION}-{epd.width}x{epd.height}-{font_version}"
+
+def get_frame(epd, name):
+    """Returns the packed (black, red) buffers of a static screen.
+
+    Frames are rendered and packed once, then served from memory or from
+    FRAME_CACHE_DIR.
+    """
+    key = frame_key(epd, name)
+    frame = _frames.get(key)
+    if frame is not None:
+        return frame
+
+    path = os.path.join(FRAME_CACHE_DIR, key + '.bin') if FRAME_CACHE_DIR else None
+    plane_size = (epd.width + 7) // 8 * epd.height
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) != 2 * plane_size:
+            raise ValueError(f"Bad frame size {len(data)}")
+        frame = (data[:plane_size], data[plane_size:])
+    except (TypeError, OSError, ValueError):
+        image_black, image_red = STATIC_SCREENS[name](epd)
+        frame = (bytes(epd.getbuffer(image_black, 0)), bytes(epd.getbuffer(image_red, 1)))
+        if path:
+            try:
+                os.makedirs(FRAME_CACHE_DIR, exist_ok=True)
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(frame[0] + frame[1])
+                os.replace(path + '.tmp', path)
+            except OSError as e:
+                logger.warning(f"Could not persist frame {key}: {e}")
+
+    _frames[key] = frame
+    return frame
+
+def frame_hash(frame):
+    return hashlib.blake2b(frame[0] + frame[1], digest_size=16).hexdigest()
+
+def load_panel_hash():
+    try:
+        with open(PANEL_STATE_FILE) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def save_panel_hash(digest):
+    try:
+        with open(PANEL_STATE_FILE, 'w') as f:
+            f.write(digest or '')
+    except OSError as e:
+        logger.warning(f"Could not save panel state: {e}")
 
 class HabitTracker:
-    def __init__(self):
-        self.epd = epd2in13b_V4.EPD()
-        logger.info("Init")
-        self.epd.init()
+    def __init__(self, idle_timeout=PANEL_IDLE_TIMEOUT):
+        self.epd = panel_driver().EPD()
+        # Panel power state. The lock serialises panel access between the
+        # caller and the idle timer; sleep_token invalidates pending sleeps.
+        self.awake = False
+        self.lock = threading.RLock()
+        self.idle_timeout = idle_timeout
+        self.sleep_timer = None
+        self.sleep_token = 0
         # Ensure DB is initialized
         database.init_db()
-        
-    def initialize(self):
-        self.epd.init()
-        draw_wyao(self.epd)
-        self.sleep()
+        # Pre-render static screens so transitions only send buffers
+        for name in STATIC_SCREENS:
+            get_frame(self.epd, name)
+        self.panel_hash = load_panel_hash()
 
-    def update(self):
-        self.epd.init() # Ensure awake and SPI open
-        # Update stats in DB
+    def wake(self):
+        """Makes sure the panel is initialised, reusing a live session."""
+        with self.lock:
+            self.cancel_sleep()
+            if not self.awake:
+                logger.info("Init")
+                self.epd.init()
+                self.awake = True
+
+    def idle(self):
+        """Schedules deep sleep once the panel has been idle for idle_timeout.
+
+        With idle_timeout None the caller is responsible for sleep().
+        """
+        with self.lock:
+            self.cancel_sleep()
+            if not self.awake or self.idle_timeout is None:
+                return
+            if self.idle_timeout <= 0:
+                self.sleep()
+                return
+            token = self.sleep_token
+            self.sleep_timer = threading.Timer(self.idle_timeout, self.sleep_if_idle, args=(token,))
+            self.sleep_timer.daemon = True
+            self.sleep_timer.start()
+
+    def cancel_sleep(self):
+        with self.lock:
+            self.sleep_token += 1
+            if self.sleep_timer:
+                self.sleep_timer.cancel()
+                self.sleep_timer = None
+
+    def sleep_if_idle(self, token):
+        with self.lock:
+            # Panel was used again after this sleep was scheduled
+            if token != self.sleep_token:
+                return
+            self.sleep_timer = None
+            self.sleep()
+
+    def show(self, frame, force=False):
+        """Sends packed (black, red) buffers unless the panel already shows them."""
+        digest = frame_hash(frame)
+        with self.lock:
+            if digest == self.panel_hash and not force:
+                logger.info("Frame already on panel, skipping refresh")
+                return False
+
+            self.wake()
+            # Forget the old frame first, so an interrupted refresh is redone
+            save_panel_hash(None)
+            with metrics.span('display'):
+                self.epd.display(*frame)
+            self.panel_hash = digest
+            save_panel_hash(digest)
+            self.idle()
+        return True
+
+    def initialize(self, force=False):
+        logger.info("Drawing Init State (WYAO)")
+        self.show(get_frame(self.epd, 'wyao'), force)
+
+    def log(self):
+        # Update stats in DB; independent of the panel
         database.add_log()
-        
-        # Show stats
-        draw_stats(self.epd)
+
+    def draw_stats(self):
+        # Show stats as they are in the DB at render time
+        logger.info("Drawing Update State")
+        with metrics.span('render', screen='stats'):
+            image_black, image_red = render_stats(self.epd)
+        with metrics.span('pack'):
+            frame = (self.epd.getbuffer(image_black, 0), self.epd.getbuffer(image_red, 1))
+        self.show(frame)
+
+    def update(self):
+        self.log()
+        self.draw_stats()
         
     def draw_done_screen(self):
-        self.epd.init()
-        draw_done_screen(self.epd)
-        self.sleep()
+        logger.info("Drawing Done Screen")
+        self.show(get_frame(self.epd, 'done'))
         
-    def reset(self):
-        self.epd.init() # Ensure awake and SPI open
+    def reset(self, force=False):
         # Revert to WYAO
-        draw_wyao(self.epd)
-        self.sleep()
+        self.initialize(force)
         
     def sleep(self):
-        logger.info("Goto Sleep...")
-        self.epd.sleep()
+        """Deep-sleeps the panel now. Call before exiting."""
+        with self.lock:
+            self.cancel_sleep()
+            if not self.awake:
+                return
+            logger.info("Goto Sleep...")
+            self.epd.sleep()
+            self.awake = False
 
 def main():
     parser = argparse.ArgumentParser(description='Habit Tracker Display')
@@ -326,8 +461,7 @@ def main():
         tracker = HabitTracker()
         
         if args.init:
-            tracker.reset()
-            tracker.sleep()
+            tracker.reset(force=True)
         else:
             tracker.update()
             
@@ -336,13 +470,15 @@ def main():
             time.sleep(15)
             
             tracker.reset()
-            tracker.sleep()
+
+        # One-shot run: power the panel down now rather than on the idle timer
+        tracker.sleep()
         
     except Exception as e:
         logger.error(f"Unhandled Exception: {e}", exc_info=True)
     except KeyboardInterrupt:    
         logger.info("ctrl + c:")
-        epd2in13b_V4.epdconfig.module_exit()
+        panel_driver().epdconfig.module_exit()
         exit()
 
 if __name__ == "__main__":